@@ -0,0 +1,76 @@
+"""
+Persistent set of the todos already in the Archive note
+The Archive only grows, so instead of re-reading, deduplicating and
+re-rendering all of it every day, the fingerprints of new archived todos
+are checked against this set and the todos appended at the end of the
+note. The set remembers the mtime/size of the Archive it matches, and is
+rebuilt from the note when the Archive was changed by hand
+"""
+
+import logging
+from typing import Callable, Iterable, List, Optional
+
+from vault_files import file_stamp, load_json, save_json_atomic
+
+INDEX_VERSION = 2
+alogger = logging.getLogger(__name__)
+
+
+def _archive_stamp(path: str) -> Optional[List[int]]:
+    """The stamp of the Archive as the index saves it, None while there is
+    no Archive"""
+    try:
+        return list(file_stamp(path))
+    except OSError:
+        return None
+
+
+class ArchiveIndex:
+    def __init__(self, index_file: str, archive_file: str):
+        self.index_file = index_file
+        self.archive_file = archive_file
+        self.fingerprints = set()
+        self.stamp = None
+        self.dirty = False
+
+    def load(self, read_archive_fingerprints: Callable[[], Iterable[str]]):
+        """Load the set, read_archive_fingerprints() gives the fingerprints
+        of the todos in the Archive and is only called when the set is out
+        of date"""
+        data = load_json(self.index_file,
+                         version=INDEX_VERSION,
+                         archive_file=self.archive_file,
+                         stamp=_archive_stamp(self.archive_file))
+        if data is not None:
+            self.fingerprints = set(data["fingerprints"])
+            self.stamp = data["stamp"]
+            return
+        alogger.info(f"Rebuilding archive index from {self.archive_file}")
+        self.rebuild(read_archive_fingerprints())
+
+    def rebuild(self, fingerprints: Iterable[str]):
+        self.fingerprints = set(fingerprints)
+        self.dirty = True
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return fingerprint in self.fingerprints
+
+    def add(self, fingerprints: Iterable[str]):
+        self.fingerprints.update(fingerprints)
+        self.dirty = True
+
+    def sync(self):
+        """Match the set with the Archive as it is on disk now, and save it
+        """
+        stamp = _archive_stamp(self.archive_file)
+        if not self.dirty and stamp == self.stamp:
+            return
+        self.stamp = stamp
+        data = {
+            "version": INDEX_VERSION,
+            "archive_file": self.archive_file,
+            "stamp": self.stamp,
+            "fingerprints": sorted(self.fingerprints),
+        }
+        save_json_atomic(self.index_file, data)
+        self.dirty = False
@@ -0,0 +1,190 @@
+"""
+Persistent inverted index of backlinked todos
+Maps a target note name to the open todo lines, across the daily notes
+directory, that link to it with [[<target>]]. Every file entry remembers the
+mtime/size it was built from, so a refresh only re-reads the notes that have
+changed since the last run
+"""
+
+import os
+import re
+import logging
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Pattern, Tuple
+from parallel import parallel_map, pipeline_map
+from profiling import profiler
+from vault_files import file_stamp, load_json, save_json_atomic, walk_notes
+
+INDEX_VERSION = 1
+LINK_PATTERN = re.compile(r"\[\[([^\[\]]+)\]\]")
+ilogger = logging.getLogger(__name__)
+
+
+def walk_order(path: str, notes_dir: str):
+    """Sort key matching a sorted os.walk, files of a directory come before
+    the contents of its subdirectories"""
+    parts = os.path.relpath(path, notes_dir).split(os.sep)
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+
+
+def index_note_lines(note_segments: Iterable[str],
+                     task_pattern: Pattern) -> Dict[str, str]:
+    """Keep only the open todo lines that carry a [[link]], the note comes
+    as runs of whole lines so that it never has to be in memory at once"""
+    lines = {}
+    lineno = 0
+    for segment in note_segments:
+        segment_lines = segment.split("\n")
+        if "[[" in segment:
+            for offset, line in enumerate(segment_lines):
+                if "[[" not in line:
+                    continue
+                if task_pattern.search(line):
+                    lines[str(lineno + offset)] = line
+        lineno += len(segment_lines)
+    profiler.count("lines_scanned", lineno)
+    return lines
+
+
+def _read_and_index_note(read_note: Callable[[str, str], Iterable[str]],
+                         task_pattern: Pattern, notename: str,
+                         root: str) -> Dict[str, str]:
+    return index_note_lines(read_note(notename, root), task_pattern)
+
+
+def _read_whole_note(read_note: Callable[[str, str], Iterable[str]],
+                     notename: str, root: str) -> List[str]:
+    return list(read_note(notename, root))
+
+
+def _index_read_note(task_pattern: Pattern, segments: List[str],
+                     notename: str, root: str) -> Dict[str, str]:
+    return index_note_lines(segments, task_pattern)
+
+
+class BacklinkIndex:
+    def __init__(self, index_file: str, notes_dir: str, task_pattern: str):
+        self.index_file = index_file
+        self.notes_dir = notes_dir
+        self.task_pattern = re.compile(task_pattern)
+        # path -> {"stamp": (mtime_ns, size), "notename": str,
+        #          "lines": {lineno: line}}
+        self.files: Dict[str, Dict] = {}
+        # target -> [[path, lineno], ...] in walk order
+        self.targets: Dict[str, List[List]] = {}
+        self.dirty = False
+        self.files_read = 0
+        # paths indexed since the last look, not saved with the index
+        self.reindexed: List[str] = []
+
+    def load(self):
+        """Load the index from disk, a missing or unreadable index starts
+        empty and gets rebuilt on the next refresh"""
+        data = load_json(self.index_file,
+                         version=INDEX_VERSION,
+                         notes_dir=self.notes_dir)
+        if data is None:
+            return
+        self.files = data["files"]
+        for entry in self.files.values():
+            if entry["stamp"] is not None:
+                entry["stamp"] = tuple(entry["stamp"])
+        self.targets = data["targets"]
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": INDEX_VERSION,
+            "notes_dir": self.notes_dir,
+            "files": self.files,
+            "targets": self.targets,
+        }
+        save_json_atomic(self.index_file, data)
+        self.dirty = False
+        ilogger.debug(f"Saved backlink index to {self.index_file}")
+
+    def refresh(self,
+                read_note: Callable[[str, str], Iterable[str]],
+                jobs: int = 1,
+                pool: str = "thread"):
+        """Bring the index in line with the notes directory
+        read_note(notename, root) returns the note text as runs of whole
+        lines, and is only called for notes whose mtime/size differ from the
+        indexed ones. Those are read over jobs workers of the given pool
+        """
+        files = {}
+        stale = []
+        # in walk order, so that backlinks come out the same way on every
+        # filesystem
+        for path, root, fname in walk_notes(self.notes_dir):
+            stamp = file_stamp(path)
+            entry = self.files.get(path)
+            if entry is None or entry["stamp"] != stamp:
+                entry = {"stamp": stamp, "notename": fname.split(".")[0]}
+                stale.append((path, entry, root))
+            files[path] = entry
+        notenames = [entry["notename"] for _, entry, _ in stale]
+        roots = [root for _, _, root in stale]
+        if pool == "async":
+            # notes are read in full on the readers, and indexed as they
+            # come in
+            indexed_lines = pipeline_map(
+                partial(_read_whole_note, read_note),
+                partial(_index_read_note, self.task_pattern),
+                notenames,
+                roots,
+                jobs=jobs)
+        else:
+            indexed_lines = parallel_map(partial(_read_and_index_note,
+                                                 read_note, self.task_pattern),
+                                         notenames,
+                                         roots,
+                                         jobs=jobs,
+                                         pool=pool)
+        for (_, entry, _), lines in zip(stale, indexed_lines):
+            entry["lines"] = lines
+        self.reindexed.extend(path for path, _, _ in stale)
+        self.files_read += len(stale)
+        if stale or list(files) != list(self.files):
+            self.files = files
+            self._rebuild_targets()
+            self.dirty = True
+
+    def update_note(self, path: str, notename: str, note_text: str):
+        """Index note_text for path without touching the disk, used for notes
+        that are only held in memory. The entry has no stamp, so the next
+        refresh will re-read whatever ends up on disk
+        """
+        is_new = path not in self.files
+        self.files[path] = {
+            "stamp": None,
+            "notename": notename,
+            "lines": index_note_lines([note_text], self.task_pattern),
+        }
+        self.reindexed.append(path)
+        if is_new:
+            self.files = {
+                p: self.files[p]
+                for p in sorted(self.files,
+                                key=lambda p: walk_order(p, self.notes_dir))
+            }
+        self._rebuild_targets()
+        self.dirty = True
+
+    def _rebuild_targets(self):
+        targets = {}
+        for path, entry in self.files.items():
+            for lineno, line in entry["lines"].items():
+                for target in dict.fromkeys(LINK_PATTERN.findall(line)):
+                    targets.setdefault(target, []).append([path, lineno])
+        self.targets = targets
+
+    def lookup(self, target: str) -> List[Tuple[str, str]]:
+        """(source notename, line) for every indexed todo linking to target
+        """
+        backlinks = []
+        for path, lineno in self.targets.get(target, []):
+            entry = self.files[path]
+            backlinks.append((entry["notename"], entry["lines"][lineno]))
+        return backlinks
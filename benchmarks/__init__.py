@@ -0,0 +1,3 @@
+"""Benchmarks for the daily notes pipeline, run them from the repo root
+e.g. python -m benchmarks.bench_scanner
+"""
@@ -0,0 +1,77 @@
+"""
+Backlink index build over a fake filesystem where every read blocks for a
+while, the way opening a Dropbox placeholder does, serial against the
+thread pool and the async pipeline
+python -m benchmarks.bench_async_reader [-n NOTES] [-l LATENCY_MS] [-j JOBS]
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from backlink_index import BacklinkIndex
+from benchmarks.vault import generate_vault
+from daily_notes import OPEN_TASK_PATTERN
+from vault_files import walk_notes
+
+
+class FakeFilesystem:
+    """Serves the notes of a directory from memory, every read sleeps for
+    latency seconds first"""
+    def __init__(self, dn_dir: str, latency: float):
+        self.latency = latency
+        self.notes: Dict[str, str] = {}
+        for path, root, fname in walk_notes(dn_dir):
+            with open(path, "r") as f:
+                self.notes[f"{root}/{fname.split('.')[0]}"] = f.read().rstrip()
+        self.lock = threading.Lock()
+        self.reading = 0
+        self.most_reading = 0
+
+    def read_note(self, notename: str, root: str) -> List[str]:
+        with self.lock:
+            self.reading += 1
+            self.most_reading = max(self.most_reading, self.reading)
+        time.sleep(self.latency)
+        with self.lock:
+            self.reading -= 1
+        return [self.notes[f"{root}/{notename}"]]
+
+
+def build_index(dn_dir: str, index_file: str, filesystem: FakeFilesystem,
+                jobs: int, pool: str):
+    index = BacklinkIndex(index_file, dn_dir, OPEN_TASK_PATTERN)
+    filesystem.most_reading = 0
+    start = time.perf_counter()
+    index.refresh(filesystem.read_note, jobs=jobs, pool=pool)
+    return time.perf_counter() - start, index.targets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="notes", type=int, default=500)
+    parser.add_argument("-l", dest="latency_ms", type=float, default=20)
+    parser.add_argument("-j", dest="jobs", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as vault_dir:
+        dn_dir = generate_vault(vault_dir, args.notes)
+        index_file = f"{vault_dir}/index.json"
+        filesystem = FakeFilesystem(dn_dir, args.latency_ms / 1000)
+        serial_time, serial_targets = build_index(dn_dir, index_file,
+                                                  filesystem, 1, "thread")
+        print(f"{'serial':>12}: {serial_time * 1000:8.1f} ms")
+        for pool in ("thread", "async"):
+            elapsed, targets = build_index(dn_dir, index_file, filesystem,
+                                           args.jobs, pool)
+            assert targets == serial_targets
+            assert filesystem.most_reading <= args.jobs
+            print(f"{pool:>6} x{args.jobs:<4}: {elapsed * 1000:8.1f} ms "
+                  f"({serial_time / elapsed:.2f}x, at most "
+                  f"{filesystem.most_reading} reads at once)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Microbenchmark of the note calendar against the regex/strptime/strftime
+conversions it replaced, over the note names and day steps of a range run
+python -m benchmarks.bench_dates [-n NAMES] [-r REPEAT]
+"""
+
+import argparse
+import datetime
+import random
+import re
+import timeit
+
+from dates import NoteCalendar
+from daily_notes import DATE_PATTERNS, NOTE_FORMAT
+
+
+def legacy_day(note_name: str) -> int:
+    """What get_date_from_note_name used to do, without its lru_cache"""
+    t = re.search(r"\d+", note_name)
+    return datetime.datetime.strptime(t.group(0), "%Y%m%d").toordinal()
+
+
+def legacy_note_name_for(target: str, timedelta: int) -> str:
+    """What get_note_name_for used to do"""
+    match = re.search(r"\d{4}-\d{2}-\d{2}", target)
+    date = datetime.datetime.fromisoformat(match.group(0))
+    return (date + datetime.timedelta(timedelta)).strftime("D%Y%m%d")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="names", type=int, default=10000)
+    parser.add_argument("-r", dest="repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    today = datetime.date.today()
+    days = [
+        today.toordinal() + rnd.randint(-365, 60) for _ in range(args.names)
+    ]
+    names = [datetime.date.fromordinal(day).strftime("D%Y%m%d") for day in days]
+    isodates = [datetime.date.fromordinal(day).isoformat() for day in days]
+    calendar = NoteCalendar(*DATE_PATTERNS[NOTE_FORMAT])
+    assert [calendar.day(name) for name in names] == days
+    assert [calendar.note_name(day - 1) for day in days
+            ] == [legacy_note_name_for(iso, -1) for iso in isodates]
+
+    cases = {
+        "name -> day": (lambda: [legacy_day(name) for name in names],
+                        lambda: [calendar.day(name) for name in names]),
+        "day -1 -> name":
+        (lambda: [legacy_note_name_for(iso, -1) for iso in isodates],
+         lambda: [calendar.note_name(day - 1) for day in days]),
+    }
+    for case, (legacy, service) in cases.items():
+        for name, convert in (("legacy", legacy), ("calendar", service)):
+            best = min(timeit.repeat(convert, number=1, repeat=args.repeat))
+            print(f"{case:>15} {name:>8}: {best * 1e9 / args.names:8.0f} ns "
+                  f"per conversion")
+    build = min(
+        timeit.repeat(lambda: NoteCalendar(*DATE_PATTERNS[NOTE_FORMAT]),
+                      number=1,
+                      repeat=args.repeat))
+    print(f"calendar built in {build * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
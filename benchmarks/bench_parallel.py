@@ -0,0 +1,47 @@
+"""
+Scaling of a full backlink index build from 1 to 8 workers, on a generated
+vault of 5k notes
+python -m benchmarks.bench_parallel [-n NOTES] [--pool thread|process|async]
+"""
+
+import argparse
+import tempfile
+import time
+
+from backlink_index import BacklinkIndex
+from benchmarks.vault import generate_vault
+from daily_notes import OPEN_TASK_PATTERN, read_note_segments
+
+WORKERS = [1, 2, 4, 8]
+
+
+def build_index(dn_dir: str, index_file: str, jobs: int, pool: str):
+    index = BacklinkIndex(index_file, dn_dir, OPEN_TASK_PATTERN)
+    start = time.perf_counter()
+    index.refresh(read_note_segments, jobs=jobs, pool=pool)
+    return time.perf_counter() - start, index.targets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="notes", type=int, default=5000)
+    parser.add_argument("--pool",
+                        choices=["thread", "process", "async"],
+                        default="process")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as vault_dir:
+        dn_dir = generate_vault(vault_dir, args.notes)
+        index_file = f"{vault_dir}/index.json"
+        serial_time, serial_targets = build_index(dn_dir, index_file, 1,
+                                                  args.pool)
+        for jobs in WORKERS:
+            elapsed, targets = build_index(dn_dir, index_file, jobs,
+                                           args.pool)
+            assert targets == serial_targets
+            print(f"{args.pool} x{jobs}: {elapsed * 1000:8.1f} ms "
+                  f"({serial_time / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Quotes for a new note against a stub of the stoic api served on an
+ephemeral port: a quick api, one slower than the time budget, one that fails
+and a dry run. Reports how long each note waited for its quote
+python -m benchmarks.bench_quotes [-b BUDGET_MS] [-s SLOW_MS]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import quotes
+from quotes import STOIC_API_PAGES, QuotesGetter
+
+
+class StubApi(BaseHTTPRequestHandler):
+    """Pages of the stoic api, after delay seconds, or a 500 when failing"""
+    delay = 0.0
+    failing = False
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        if self.failing:
+            self.send_error(500)
+            return
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        body = json.dumps({
+            "data": [{"body": f"quote {page}.{i}", "author": "Seneca"}
+                     for i in range(10)]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(delay: float = 0.0, failing: bool = False) -> ThreadingHTTPServer:
+    handler = type("Handler", (StubApi,), {"delay": delay,
+                                           "failing": failing})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_quote(quotes_file: str, server: ThreadingHTTPServer, budget: float,
+              read_only: bool = False):
+    host, port = server.server_address
+    getter = QuotesGetter(quotes_file=quotes_file,
+                          api_url=f"http://{host}:{port}/v1/api/quotes",
+                          time_budget=budget,
+                          read_only=read_only)
+    start = time.perf_counter()
+    quote = getter.get_a_random_quote()
+    return quote, time.perf_counter() - start
+
+
+def report(name: str, quote, elapsed: float):
+    print(f"{name:>10}: {elapsed * 1000:8.1f} ms  {quote}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", dest="budget_ms", type=float, default=200)
+    parser.add_argument("-s", dest="slow_ms", type=float, default=1000)
+    args = parser.parse_args()
+    budget = args.budget_ms / 1000
+    slow = args.slow_ms / 1000
+    # the api is only ever called when quotes.json is missing, so quotes
+    # are written to their own file in each case
+    quotes.logger.setLevel("CRITICAL")
+
+    with tempfile.TemporaryDirectory() as shared_dir:
+        server = serve()
+        quotes_file = f"{shared_dir}/quick.json"
+        quote, elapsed = get_quote(quotes_file, server, budget)
+        assert quote is not None
+        with open(quotes_file) as f:
+            assert len(json.load(f)) == STOIC_API_PAGES
+        report("quick", quote, elapsed)
+        quote, elapsed = get_quote(quotes_file, server, budget)
+        assert quote is not None
+        report("cached", quote, elapsed)
+        server.shutdown()
+
+        server = serve(delay=slow)
+        quotes_file = f"{shared_dir}/slow.json"
+        quote, elapsed = get_quote(quotes_file, server, budget)
+        assert quote is None and elapsed < slow
+        report("slow", quote, elapsed)
+        # later notes don't wait on the api again
+        quote, elapsed = get_quote(quotes_file, server, budget)
+        assert quote is None and elapsed < budget
+        report("slow again", quote, elapsed)
+        server.shutdown()
+
+        server = serve(failing=True)
+        quotes_file = f"{shared_dir}/failing.json"
+        quote, elapsed = get_quote(quotes_file, server, budget)
+        assert quote is None
+        assert os.path.getsize(quotes_file) == 0
+        report("failing", quote, elapsed)
+        server.shutdown()
+
+        server = serve()
+        quotes_file = f"{shared_dir}/dry_run.json"
+        quote, elapsed = get_quote(quotes_file, server, budget,
+                                   read_only=True)
+        assert quote is not None
+        assert not os.path.exists(quotes_file)
+        report("dry run", quote, elapsed)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Startup budget of the cli, measured with python -X importtime
+Fails when importing cli_parser goes over the budget, or when a dependency
+that is meant to be loaded lazily gets imported at startup
+python -m benchmarks.bench_startup [--budget MS] [--runs N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_BUDGET_MS = 120
+# only needed for rendering, the api, the process pool and the server
+LAZY_MODULES = ["jinja2", "requests", "multiprocessing", "socket"]
+
+
+def measure_imports() -> Tuple[float, Dict[str, float]]:
+    """Cumulative import time of cli_parser in ms, and the self time in ms
+    of every module it imported"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import cli_parser"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True)
+    total, modules = 0.0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(self_us) / 1000
+        if name.strip() == "cli_parser":
+            total = int(cumulative_us) / 1000
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # the best of a few runs, the first one also pays for cold disk caches
+    runs = [measure_imports() for _ in range(args.runs)]
+    total, modules = min(runs, key=lambda run: run[0])
+    for name, self_ms in sorted(modules.items(),
+                                key=lambda item: item[1],
+                                reverse=True)[:10]:
+        print(f"{name:<40} {self_ms:8.2f} ms")
+    print(f"import cli_parser: {total:.1f} ms (budget {args.budget:.0f} ms)")
+
+    failures = [
+        f"{module} is imported at startup" for module in LAZY_MODULES
+        if module in modules
+    ]
+    if total > args.budget:
+        failures.append(
+            f"startup is over budget by {total - args.budget:.1f} ms")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Peak memory of scanning one large note whole against streaming it
+python -m benchmarks.bench_stream [-m MEGABYTES]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from scanner import read_segments, scan_todo_segments, scan_todos
+
+MEETING_LOG = "Talked about [the plan] for a while, nothing to do here\n" * 9
+
+
+def write_note(path: str, megabytes: int):
+    block = "- [ ] !! follow up [[D20210105]]\n" + MEETING_LOG
+    with open(path, "w") as f:
+        for _ in range(megabytes * 1024 * 1024 // len(block)):
+            f.write(block)
+
+
+def scan_whole(path: str) -> int:
+    with open(path) as f:
+        return sum(1 for _ in scan_todos(f.read().rstrip()))
+
+
+def scan_streamed(path: str) -> int:
+    with open(path) as f:
+        return sum(1 for _ in scan_todo_segments(read_segments(f)))
+
+
+def measure(scan, path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    todos = scan(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return todos, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", dest="megabytes", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".md") as note:
+        write_note(note.name, args.megabytes)
+        results = {}
+        for scan in (scan_whole, scan_streamed):
+            todos, elapsed, peak = measure(scan, note.name)
+            results[scan.__name__] = todos
+            print(f"{scan.__name__:<14} {elapsed * 1000:8.1f} ms "
+                  f"{peak / 1024 / 1024:8.2f} MiB peak")
+        assert results["scan_whole"] == results["scan_streamed"]
+
+
+if __name__ == "__main__":
+    main()
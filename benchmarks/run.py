@@ -0,0 +1,154 @@
+"""
+Benchmark suite for the daily notes pipeline
+Generates a synthetic vault, then runs every scenario against a fresh copy
+of it and reports wall time, peak memory and files read. Save the results
+with --json before and after a change to compare them
+python -m benchmarks.run [-n NOTES] [-t TODOS] [--json FILE]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+import daily_notes
+from benchmarks.vault import generate_vault, note_date, note_name
+from profiling import profiler
+
+
+def _config(notes: int, **overrides) -> Dict:
+    config = {
+        "start_datetime": note_date(notes),
+        "end_datetime": note_date(notes),
+        "current_datetime": note_date(notes),
+        "disable_writes": False,
+        "only_write_to_archive": True,
+        "only_write_to_daily_notes": True,
+        "batch": False,
+        "jobs": 1,
+        "pool": "thread",
+    }
+    config.update(overrides)
+    return config
+
+
+def scenarios(notes: int) -> Dict[str, Callable[[], None]]:
+    range_start = note_date(notes - 14)
+    return {
+        "generate_daily_note":
+        lambda: daily_notes.generate_daily_notes(_config(notes)),
+        "generate_daily_notes 14 days":
+        lambda: daily_notes.generate_daily_notes(
+            _config(notes, start_datetime=range_start)),
+        "generate_daily_notes 14 days batch":
+        lambda: daily_notes.generate_daily_notes(
+            _config(notes, start_datetime=range_start, batch=True)),
+        "generate_daily_notes 14 days sqlite":
+        lambda: daily_notes.generate_daily_notes(
+            _config(notes, start_datetime=range_start, sqlite=True)),
+        "generate_daily_notes 14 days schedule":
+        lambda: daily_notes.generate_daily_notes(
+            _config(notes, start_datetime=range_start, schedule=True)),
+        "get_backlink_todos":
+        lambda: daily_notes.get_backlink_todos(note_name(notes)),
+        "archive new todos":
+        lambda: daily_notes.get_new_archive_todos(
+            daily_notes.plan_todo_forest(
+                daily_notes.build_todo_forest(
+                    daily_notes.get_open_todos(note_name(notes - 1))))[1]),
+        "query shamed todos in a quarter":
+        lambda: daily_notes.query_todos(
+            start_date=datetime.date.fromisoformat(note_date(notes - 90)),
+            end_date=datetime.date.fromisoformat(note_date(notes)),
+            min_shame=3),
+        "upcoming 7 days":
+        lambda: daily_notes.get_schedule(build=True).upcoming(
+            datetime.date.fromisoformat(note_date(notes)).toordinal(),
+            datetime.date.fromisoformat(note_date(notes)).toordinal() + 7),
+        "compact archive":
+        lambda: daily_notes.compact_archive(_config(notes)),
+    }
+
+
+def _run_once(pristine_dir: str, scenario: Callable[[], None],
+              warm: bool, trace_memory: bool) -> Dict:
+    with tempfile.TemporaryDirectory() as vault_dir:
+        shutil.copytree(pristine_dir, vault_dir, dirs_exist_ok=True)
+        # the caches go away with the vault
+        daily_notes.configure_vault(vault_dir, cache_dir=f"{vault_dir}/cache")
+        if warm:
+            # build the persisted indexes the way an earlier run would
+            daily_notes.get_backlink_index()
+            daily_notes.get_todo_store()
+            daily_notes.open_todo_db()
+            # only the sqlite scenarios open it again, from what was saved
+            daily_notes.close_todo_db()
+            daily_notes.get_schedule(build=True)
+        profiler.start()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            scenario()
+        elapsed = time.perf_counter() - start
+        peak = 0
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        files_read = profiler.counters["files_read"]
+        profiler.enabled = False
+        # the sqlite scenarios leave it open, and the vault goes away
+        daily_notes.close_todo_db()
+    return {"seconds": elapsed, "peak_bytes": peak, "files_read": files_read}
+
+
+def run_suite(pristine_dir: str, notes: int) -> Dict[str, Dict]:
+    results = {}
+    for name, scenario in scenarios(notes).items():
+        for warm in (False, True):
+            timing = _run_once(pristine_dir, scenario, warm, False)
+            memory = _run_once(pristine_dir, scenario, warm, True)
+            timing["peak_bytes"] = memory["peak_bytes"]
+            results[f"{name} ({'warm' if warm else 'cold'})"] = timing
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="notes", type=int, default=1000)
+    parser.add_argument("-t", dest="todos_per_note", type=int, default=20)
+    parser.add_argument("--nesting-depth", type=int, default=1)
+    parser.add_argument("--backlink-density", type=float, default=0.2)
+    parser.add_argument("--max-shame", type=int, default=5)
+    parser.add_argument("--json", dest="json_file")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as pristine_dir:
+        generate_vault(pristine_dir,
+                       args.notes,
+                       todos_per_note=args.todos_per_note,
+                       nesting_depth=args.nesting_depth,
+                       backlink_density=args.backlink_density,
+                       max_shame=args.max_shame)
+        results = run_suite(pristine_dir, args.notes)
+
+    print(f"{'scenario':<44} {'ms':>10} {'peak KiB':>10} {'reads':>7}")
+    for name, result in results.items():
+        print(f"{name:<44} {result['seconds'] * 1000:>10.1f} "
+              f"{result['peak_bytes'] / 1024:>10.0f} "
+              f"{result['files_read']:>7}")
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Synthetic vaults for the benchmarks
+A vault is laid out like the real one: daily notes plus an Archive in
+Dailies, templates and quotes in Scripts
+"""
+
+import datetime
+import json
+import os
+import random
+import shutil
+
+START_DATE = datetime.date(2021, 1, 1)
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = ["DN.j2", "archive.j2"]
+
+
+def note_name(day: int) -> str:
+    return (START_DATE + datetime.timedelta(day)).strftime("D%Y%m%d")
+
+
+def note_date(day: int) -> str:
+    """YYYY-MM-DD of a day, the format the cli takes"""
+    return (START_DATE + datetime.timedelta(day)).isoformat()
+
+
+def _todo_line(rnd: random.Random, day: int, n: int, depth: int,
+               backlink_density: float, max_shame: int) -> str:
+    marker = rnd.choice([" ", " ", " ", ">", "x"])
+    text = f"task {day}-{n}"
+    if rnd.random() < backlink_density:
+        text += f" [[{note_name(day + rnd.randint(1, 30))}]]"
+    return (f"{'    ' * depth}- [{marker}] "
+            f"{'!' * rnd.randint(0, max_shame)} {text}")
+
+
+def generate_vault(directory: str,
+                   notes: int,
+                   todos_per_note: int = 20,
+                   nesting_depth: int = 1,
+                   backlink_density: float = 0.2,
+                   max_shame: int = 5,
+                   archive_todos: int = 500,
+                   seed: int = 0) -> str:
+    """Write notes daily notes into directory/Dailies, one per day from
+    START_DATE, along with an Archive, and return the Dailies directory
+    nesting_depth: how deep subtasks go below a todo
+    backlink_density: share of todos that link to a future daily note
+    max_shame: shame marks go from 0 to max_shame
+    """
+    rnd = random.Random(seed)
+    dn_dir = f"{directory}/Dailies"
+    scripts_dir = f"{directory}/Scripts"
+    os.makedirs(dn_dir, exist_ok=True)
+    os.makedirs(scripts_dir, exist_ok=True)
+    for template in TEMPLATES:
+        shutil.copy(f"{REPO_DIR}/{template}", scripts_dir)
+    with open(f"{scripts_dir}/quotes.json", "w") as f:
+        json.dump({"0": [["Waste no more time arguing", "Marcus Aurelius"]]},
+                  f)
+
+    for day in range(notes):
+        lines = ["#dailynotes", "", "## Tasks", "#todo"]
+        depth = 0
+        for n in range(todos_per_note):
+            lines.append(
+                _todo_line(rnd, day, n, depth, backlink_density, max_shame))
+            depth = rnd.randint(0, min(depth + 1, nesting_depth))
+        lines += ["", "## Work Log", "Nothing [much] to say today"] * 5
+        with open(f"{dn_dir}/{note_name(day)}.md", "w") as f:
+            f.write("\n".join(lines))
+
+    archive = ["#dailynotes #archive", "", "## Tasks", "#todo"]
+    archive += [f"- [ ] archived task {n}" for n in range(archive_todos)]
+    with open(f"{dn_dir}/Archive.md", "w") as f:
+        f.write("\n".join(archive))
+    return dn_dir
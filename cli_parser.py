@@ -1,5 +1,6 @@
 import argparse
-from daily_notes import set_options_and_generate_notes
+from daily_notes import (query_from_args, set_options_and_generate_notes,
+                         upcoming_from_args)
 import datetime
 
 
@@ -23,6 +24,37 @@ def parse():
         help=(
             "this note is to be used in conjunction with -d option to specify "
             "a range of days for generating notes"))
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help=("scan the vault once for the whole -s/-d range and write all "
+              "the notes out together at the end"))
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of workers used to read and parse notes on a full scan")
+    parser.add_argument(
+        "--pool",
+        choices=["thread", "process", "async"],
+        default="thread",
+        help=("thread suits notes on slow synced storage, process suits "
+              "CPU bound parsing, async keeps many slow reads in flight "
+              "and parses while reading (default thread)"))
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help=("keep the todos in a SQLite database in the local cache "
+              "directory and generate from it, only the notes edited since "
+              "the last run are parsed again"))
+    parser.add_argument(
+        "--schedule",
+        action="store_true",
+        help=("take backlinked todos from the schedule of linked days instead "
+              "of the backlink index, notes edited since the last run are "
+              "still checked for new links"))
     parser.add_argument(
         "-n",
         "--no-write-out",
@@ -44,8 +76,107 @@ def parse():
         "The script will only generate the daily_notes file, and ignore archive"
     )
 
+    parser.add_argument(
+        "--compact-archive",
+        action="store_true",
+        help=("rebuild the Archive note from scratch, dropping duplicates, "
+              "instead of generating notes"))
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=("time each phase of the run and write a JSON report to the "
+              "profiles folder in the vault's local cache directory"))
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="with --profile, also write a cProfile dump for pstats")
+
+    # the options above go before the command, e.g. -s ... -d ... trigger
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser(
+        "serve",
+        help=("keep the vault in memory, generate notes on request and when "
+              "the day rolls over"))
+    serve_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="seconds between checks of the notes for changes (default 5)")
+    serve_parser.add_argument("--socket",
+                              help="unix socket to listen on")
+    trigger_parser = commands.add_parser(
+        "trigger", help="have a running server generate the notes")
+    trigger_parser.add_argument("--socket",
+                                help="unix socket the server listens on")
+
+    query_parser = commands.add_parser(
+        "query",
+        help=("list the open todos across the daily notes that match all of "
+              "the options, dates are YYYY-MM-DD"))
+    query_parser.add_argument("--from",
+                              dest="query_from",
+                              help="notes dated on or after this day")
+    query_parser.add_argument("--to",
+                              dest="query_to",
+                              help="notes dated on or before this day")
+    query_parser.add_argument(
+        "--action",
+        choices=["shame", "noop", "future", "archive"],
+        help="what the next note would do with the todo")
+    query_parser.add_argument("--min-shame", type=int, default=0)
+    query_parser.add_argument("--max-shame", type=int)
+    query_parser.add_argument(
+        "--scheduled-from",
+        help="todos with a start date link on or after this day")
+    query_parser.add_argument(
+        "--scheduled-to",
+        help="todos with a start date link on or before this day")
+
+    upcoming_parser = commands.add_parser(
+        "upcoming", help="list the todos linking to the next few days")
+    upcoming_parser.add_argument("--from",
+                                 dest="upcoming_from",
+                                 help="first day, YYYY-MM-DD (default today)")
+    upcoming_parser.add_argument("--days",
+                                 type=int,
+                                 default=7,
+                                 help="how many days to list (default 7)")
+
+    vaults_parser = commands.add_parser(
+        "vaults",
+        help=("generate the notes of every vault in a JSON list of vaults, "
+              "each a home_dir plus the config it overrides"))
+    vaults_parser.add_argument("vaults_file")
+    vaults_parser.add_argument(
+        "--workers",
+        type=int,
+        help="vaults generated at the same time (default 4)")
+    vaults_parser.add_argument(
+        "--shared-dir",
+        help=("directory with the templates and quotes file for every "
+              "vault, instead of each vault's scripts directory"))
+
     args = parser.parse_args()
-    set_options_and_generate_notes(args)
+    if args.command == "query":
+        query_from_args(args)
+        return
+    if args.command == "upcoming":
+        upcoming_from_args(args)
+        return
+    if args.command == "vaults":
+        # loaded here like server, only this command needs it
+        import vaults
+        vaults.run_vaults_from_args(args)
+        return
+    if args.command:
+        # the socket machinery is only loaded for the server and its client
+        import server
+    if args.command == "serve":
+        server.serve(args)
+    elif args.command == "trigger":
+        server.trigger_from_args(args)
+    else:
+        set_options_and_generate_notes(args)
 
 
 if __name__ == "__main__":
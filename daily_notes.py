@@ -9,45 +9,82 @@ I will think about it when the time comes
 import pathlib
 import datetime
 import argparse
+import contextvars
+import functools
+import hashlib
 import re
 import os
 import sys
+import threading
 import traceback
-from jinja2 import Environment, FileSystemLoader
-from typing import List, Dict, Union, IO
+from typing import List, Dict, Iterable, Iterator, Tuple, Union, IO
 from enum import Enum
 import logging
-from quotes import QuotesGetter
-
+from quotes import QUOTES_FILE, QuotesGetter
+from backlink_index import LINK_PATTERN, BacklinkIndex, index_note_lines
+from vault_cache import VaultLocationCache
+from scanner import (SHAME_CHAR, STICKY_CHAR, TodoRecord, last_note_link,
+                     read_segments, scan_backlink, scan_todo_segments,
+                     scan_todos, strip_start_date, todo_fingerprint,
+                     use_note_names)
+from render import RenderEngine
+from archive_index import ArchiveIndex
+from note_writer import NoteTransaction
+from profiling import profiler
+from todo_store import TodoStore
+from todo_db import TodoDatabase
+from schedule import Schedule
+from dates import NoteCalendar, note_name_pattern
+from parse_cache import ParseCache, hashing_segments
+from vault_files import content_hash, content_hasher, file_stamp
+
+# the default vault, see VaultContext for how a vault is laid out
 HOME_DIR = "/Users/sahuja4/Dropbox (Facebook)/Second Brain"
 DN_FOLDER = "Dailies"
 SCRIPTS_FOLDER = "Scripts"
-TEMPLATES_FOLDER = "Templates"
 
-SCRIPT_DIR = f"{HOME_DIR}/{SCRIPTS_FOLDER}"
-DN_DIR = f"{HOME_DIR}/{DN_FOLDER}"
-TEMPLATE_DIR = f"{HOME_DIR}/{TEMPLATES_FOLDER}"
 ARCHIVE_NOTE_NAME = "Archive"
-ARCHIVE_NOTE_DIR = f"{DN_DIR}"
-SHAME_CHAR = "!"
 JINJA_TEMPLATE = "DN.j2"
 ARCHIVE_TEMPLATE = "archive.j2"
+# indexes and caches stay on this machine, out of the synced vault, so that
+# the sync client never uploads them or makes conflicted copies of them
+CACHE_ROOT = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "yaps")
+
+
+def local_cache_dir(home_dir: str) -> str:
+    """Cache directory of the vault in home_dir, one per vault path"""
+    vault_hash = hashlib.blake2b(home_dir.encode(), digest_size=8).hexdigest()
+    return f"{CACHE_ROOT}/{os.path.basename(home_dir)}-{vault_hash}"
+
+
+# compiled templates are keyed by their path, every vault can share them
+TEMPLATE_BYTECODE_CACHE_DIR = f"{CACHE_ROOT}/jinja"
 NOTE_FORMAT = "D%Y%m%d"
-DATE_FORMAT = "%Y%m%d"
+# note format -> (what finds the date in a note name, how strptime reads it,
+# how strftime writes the note name)
 DATE_PATTERNS = {
-    "YYYY-MM-DD": "\d{4}-\d{2}-\d{2}",
-    "D%Y%m%d": "\d+",
-    "DD-MM-YY": "\d{2}-\d{2}-\d{4}",
-    "MM-DD-YYYY": "\d{2}-\d{2}-\d{4}",
+    "YYYY-MM-DD": (r"\d{4}-\d{2}-\d{2}", "%Y-%m-%d", "%Y-%m-%d"),
+    "D%Y%m%d": (r"\d{8}", "%Y%m%d", "D%Y%m%d"),
+    "DD-MM-YY": (r"\d{2}-\d{2}-\d{2}", "%d-%m-%y", "%d-%m-%y"),
+    "MM-DD-YYYY": (r"\d{2}-\d{2}-\d{4}", "%m-%d-%Y", "%m-%d-%Y"),
 }
+if NOTE_FORMAT in DATE_PATTERNS:
+    # start dates are links to daily notes, whatever they are named like
+    use_note_names(note_name_pattern(*DATE_PATTERNS[NOTE_FORMAT]))
 OPEN_TASK_PATTERN = r"(\s*)-\s+\[(\s|\>)\]\s*(!*)\s*(.*)"
 CLOSED_TASK_PATTERN = r"\[x\](.*)"
 SHOULD_ARCHIVE = True
 SHAME_THRESHOLD = 5
-STICKY_CHAR = "~S~"
 HIDE_FUTURE_TODOS_FROM_DAILY_NOTE = True
 PRESERVE_ORDER = False
 dlogger = logging.getLogger(__name__)
+# render engines by shared directory and whether they keep compiled
+# templates on disk, kept across vaults and the threads working on them
+_render_engines: Dict[tuple, RenderEngine] = {}
+_render_engines_lock = threading.Lock()
+# note names and days of NOTE_FORMAT, worked out once per process
+_calendar: NoteCalendar = None
 
 
 class DateNotSupported(Exception):
@@ -77,14 +114,119 @@ class State(Enum):
     MOVED = 3
 
 
+class RunContext:
+    """State shared by every todo of a run, so that it is worked out once
+    instead of once per todo"""
+    __slots__ = ("today", "jobs", "pool", "schedule", "persist")
+
+    def __init__(self):
+        self.jobs = 1
+        self.pool = "thread"
+        # backlinks come from the schedule instead of the backlink index
+        self.schedule = False
+        # a dry run leaves the indexes and caches on disk as they are
+        self.persist = True
+        self.reset()
+
+    def reset(self):
+        self.today = datetime.date.today()
+
+
+class VaultContext:
+    """The paths and caches of one vault, and the run going on in it. Every
+    thread works on a vault of its own, see configure_vault, and the
+    threads it fans out to work on the same one. Process workers only ever
+    see the default vault"""
+    __slots__ = ("home_dir", "script_dir", "dn_dir", "archive_note_dir",
+                 "shared_dir", "cache_dir", "profile_dir",
+                 "backlink_index_file", "vault_cache_file",
+                 "archive_index_file", "todo_store_file", "todo_db_file",
+                 "schedule_file", "parse_cache_file", "run", "transaction",
+                 "run_backlink_index", "todo_db", "resident_backlink_index",
+                 "vault_caches", "archive_index", "schedule", "parse_cache")
+
+    def __init__(self,
+                 home_dir: str,
+                 shared_dir: str = None,
+                 cache_dir: str = None):
+        """Templates and quotes come from shared_dir when given, instead of
+        the vault's scripts directory, and the caches go to cache_dir when
+        given, instead of the vault's local cache directory"""
+        self.home_dir = home_dir
+        self.script_dir = f"{home_dir}/{SCRIPTS_FOLDER}"
+        self.dn_dir = f"{home_dir}/{DN_FOLDER}"
+        self.archive_note_dir = self.dn_dir
+        # templates and the quotes file, several vaults can share them
+        self.shared_dir = shared_dir or self.script_dir
+        self.cache_dir = cache_dir or local_cache_dir(home_dir)
+        # reports stay on this machine, out of the synced vault
+        self.profile_dir = f"{self.cache_dir}/profiles"
+        self.backlink_index_file = f"{self.cache_dir}/backlink_index.json"
+        self.vault_cache_file = f"{self.cache_dir}/vault_cache.json"
+        self.archive_index_file = f"{self.cache_dir}/archive_index.json"
+        self.todo_store_file = f"{self.cache_dir}/todo_store.json"
+        self.todo_db_file = f"{self.cache_dir}/todos.sqlite3"
+        self.schedule_file = f"{self.cache_dir}/schedule.json"
+        self.parse_cache_file = f"{self.cache_dir}/parse_cache"
+        self.run = RunContext()
+        # Notes written during a run are staged here instead of going to
+        # disk, and reads see them. commit_writes() puts them all on disk at
+        # once
+        self.transaction: NoteTransaction = None
+        # backlink index kept in memory while a transaction is open
+        self.run_backlink_index: BacklinkIndex = None
+        # todo database of --sqlite runs, kept open across runs
+        self.todo_db: TodoDatabase = None
+        # backlink index kept across runs by a long running process
+        self.resident_backlink_index: BacklinkIndex = None
+        # note location caches, by vault directory
+        self.vault_caches: Dict[str, VaultLocationCache] = {}
+        # todos already in the Archive note, loaded once per run
+        self.archive_index: ArchiveIndex = None
+        # calendar of the days linked from todos, loaded once per run
+        self.schedule: Schedule = None
+        # todos scanned from the notes, loaded once per vault
+        self.parse_cache: ParseCache = None
+
+
+# the vault of the running thread, the one in HOME_DIR unless the thread was
+# pointed at another one
+_current_vault = contextvars.ContextVar("vault",
+                                        default=VaultContext(HOME_DIR))
+
+
+def current_vault() -> VaultContext:
+    return _current_vault.get()
+
+
+def configure_vault(home_dir: str,
+                    shared_dir: str = None,
+                    cache_dir: str = None) -> VaultContext:
+    """Point the running thread at the vault in home_dir, laid out like the
+    default one, see VaultContext for shared_dir and cache_dir. The vault
+    starts with nothing cached, and other threads keep their own vault"""
+    vault = VaultContext(home_dir, shared_dir, cache_dir)
+    _current_vault.set(vault)
+    return vault
+
+
 class Todo:
+    """A single todo line. Planning the next action is left until the
+    action or the upcoming shame is first looked at, most backlinked todos
+    are set to NOOP without ever needing it
+    """
+    __slots__ = ("raw_text", "src_note", "target_note", "front_spaces",
+                 "marker", "shame", "text", "start_date_note", "fingerprint",
+                 "_action", "_upcoming_shame")
+
     def __init__(self,
                  raw_text,
                  notename,
                  front_spaces="",
                  todo_marker="x",
                  todo_shame="",
-                 todo_text=""):
+                 todo_text="",
+                 start_date_note=None):
         self.raw_text = raw_text
         self.src_note = notename
         self.target_note = None
@@ -92,39 +234,78 @@ class Todo:
         self.marker = f"[{todo_marker}]"
         self.shame = todo_shame
         self.text = todo_text.strip()
-        self.upcoming_shame = ""
-        self.action = Action.NOOP
+        self._upcoming_shame = None
+        self._action = None
         self.start_date_note = None
-        self.get_target_note_from_todo_text()
-        self.plan_next_action()
+        self.get_target_note_from_todo_text(start_date_note)
+        # what duplicates are found by, in the notes and in the Archive
+        self.fingerprint = todo_fingerprint(self.text)
+
+    @classmethod
+    def from_record(cls, record: TodoRecord, notename: str):
+        return cls(raw_text=record.raw_text,
+                   notename=notename,
+                   front_spaces=record.front_spaces,
+                   todo_marker=record.marker,
+                   todo_shame=record.shame,
+                   todo_text=record.text,
+                   start_date_note=record.start_date_note)
+
+    @property
+    def action(self) -> Action:
+        if self._action is None:
+            self.plan_next_action()
+        return self._action
+
+    @action.setter
+    def action(self, action: Action):
+        self._action = action
+
+    @property
+    def upcoming_shame(self) -> str:
+        if self._upcoming_shame is None:
+            # an action that was set explicitly wins over the planned one
+            action = self._action
+            self.plan_next_action()
+            if action is not None:
+                self._action = action
+        return self._upcoming_shame
+
+    @upcoming_shame.setter
+    def upcoming_shame(self, upcoming_shame: str):
+        self._upcoming_shame = upcoming_shame
 
     def set_action(self, action: Action):
         self.action = action
 
-    def get_target_note_from_todo_text(self):
+    def get_target_note_from_todo_text(self, start_date_note=None):
         """The first [[<daily_note>]] which follows the text will be
-        the start_date note name"""
-        start_date_regex = r"\[\[(D\d+)\]\]"
-        matches = re.findall(start_date_regex, self.raw_text)
-        if matches:
+        the start_date note name, the scanner hands it over when it has
+        already found it"""
+        if start_date_note is None and "[[" in self.raw_text:
             # the last match will blindly be the start date
-            self.start_date_note = matches[-1]
-            self.text = self.text.split(
-                f"[[{self.start_date_note}]]")[0].strip()
+            start_date_note = last_note_link(self.raw_text)
+        if start_date_note:
+            self.start_date_note = start_date_note
+            self.text = strip_start_date(self.text, start_date_note)
 
     def is_start_date_in_future(self) -> bool:
         if not self.start_date_note:
             return False
-        today = datetime.date.today()
         try:
-            start_date = get_date_from_note_name(self.start_date_note)
+            start_day = note_ordinal(self.start_date_note)
         except DateNotSupported:
             raise DateNotSupported(
                 f"Your start date (specified as [[]] at the end of the todo) is not in note format {NOTE_FORMAT}"
             )
-        return today < start_date.date()
+        if start_day is None:
+            raise DateTextNotFound(
+                f"{self.start_date_note} in {self.src_note} is not a date")
+        return current_vault().run.today.toordinal() < start_day
 
     def plan_next_action(self):
+        self.action = Action.NOOP
+        self.upcoming_shame = ""
         # if the note is stickied, don't add shame
         if STICKY_CHAR in self.text:
             return
@@ -158,25 +339,69 @@ class Todo:
         return f"{self.front_spaces} {self.marker} {self.text})"
 
 
-def get_date_from_note_name(note_name: str) -> datetime.datetime:
-    """Return day date from note_name
-    """
-    pattern = DATE_PATTERNS.get(NOTE_FORMAT, None)
-    if not pattern:
-        raise DateNotSupported(f"{NOTE_FORMAT} is not supported")
+class TodoNode:
+    """A todo with the subtasks nested under it"""
+    __slots__ = ("todo", "children")
 
-    t = re.search(pattern, note_name)
-    if t and t.group(0):
-        date_text = t.group(0)
-    else:
+    def __init__(self, todo: Todo):
+        self.todo = todo
+        self.children: List[TodoNode] = []
+
+    def __repr__(self):
+        return f"{__class__.__name__}({self.todo!r}, {self.children})"
+
+
+def indent_width(front_spaces: str) -> int:
+    return len(front_spaces.expandtabs(4))
+
+
+def build_todo_forest(todos: List[Todo]) -> List[TodoNode]:
+    """Nest todos, in note order, under the closest todo above them that is
+    indented less, in one pass"""
+    roots = []
+    # (indent width, node) of the todos that can still take subtasks
+    stack = []
+    for todo in todos:
+        node = TodoNode(todo)
+        width = indent_width(todo.front_spaces)
+        while stack and stack[-1][0] >= width:
+            stack.pop()
+        if stack:
+            stack[-1][1].children.append(node)
+        else:
+            roots.append(node)
+        stack.append((width, node))
+    return roots
+
+
+def iter_todo_forest(roots: List[TodoNode]) -> Iterator[Todo]:
+    """Every todo of the forest in note order"""
+    for node in roots:
+        yield node.todo
+        yield from iter_todo_forest(node.children)
+
+
+def get_calendar() -> NoteCalendar:
+    global _calendar
+    if _calendar is None:
+        if NOTE_FORMAT not in DATE_PATTERNS:
+            raise DateNotSupported(f"{NOTE_FORMAT} is not supported")
+        _calendar = NoteCalendar(*DATE_PATTERNS[NOTE_FORMAT])
+    return _calendar
+
+
+def note_ordinal(notename: str) -> int:
+    """Day ordinal of a daily note, None for any other note"""
+    return get_calendar().day(notename)
+
+
+def get_date_from_note_name(note_name: str) -> datetime.datetime:
+    """Return day date from note_name"""
+    day = note_ordinal(note_name)
+    if day is None:
         raise DateTextNotFound(
-            f"Nothing found inside {note_name} that looks like a  date")
-    try:
-        note_date = datetime.datetime.strptime(date_text, DATE_FORMAT)
-    except Exception as e:
-        print(
-            f"Trouble in converting {date_text} to note_name, Full error {e}")
-    return note_date
+            f"Nothing found inside {note_name} that looks like a date")
+    return datetime.datetime.fromordinal(day)
 
 
 def add_day_delta(note_date: datetime.datetime, timedelta: int):
@@ -189,183 +414,654 @@ def get_note_name_from_date(note_date: datetime.datetime) -> str:
     note_date: datetime object
     Get note_name from note_date
     """
-    return note_date.strftime(NOTE_FORMAT)
+    return get_calendar().note_name(note_date.toordinal())
+
+
+@functools.lru_cache(maxsize=None)
+def _iso_ordinal(target: str) -> int:
+    match = re.search(r"\d{4}-\d{2}-\d{2}", target)
+    # Supported only the iso format YYYY-MM-DD
+    return datetime.date.fromisoformat(match.group(0)).toordinal()
 
 
 def get_note_name_for(target: str, timedelta: int) -> str:
     """Get filenames for target date
     """
-
-    match = re.search(r"\d{4}-\d{2}-\d{2}", target)
-    if match:
-        target = match.group(0)
-    # Supported only the iso format YYYY-MM-DD
-    dateObject = datetime.datetime.fromisoformat(match.group(0))
-    targetDateObject = add_day_delta(dateObject, timedelta)
-    return get_note_name_from_date(targetDateObject)
+    return get_calendar().note_name(_iso_ordinal(target) + timedelta)
 
 
 def get_file_path_from_vault(notename, directory):
-    """Search for a note inside the entire vault
+    """Search for a note inside the entire vault, through the persisted
+    note location cache
     """
-    matches = pathlib.Path(directory).glob(f"**/{notename}.md")
-    return list(matches)
+    vault = current_vault()
+    vault_cache = vault.vault_caches.get(directory)
+    if vault_cache is None:
+        vault_cache = VaultLocationCache(vault.vault_cache_file, directory)
+        vault.vault_caches[directory] = vault_cache
+    matches = vault_cache.lookup(notename)
+    if vault.run.persist:
+        vault_cache.save()
+    return [pathlib.Path(match) for match in matches]
+
+
+def _locate_note(notename: str, directory: str) -> str:
+    """Path of the note, looked for in the whole vault when it isn't in
+    directory"""
+    filename = f"{directory}/{notename}.md"
+    filePath = pathlib.Path(filename)
+    if not filePath.is_file():
+        # it's possible the file changes dirs, so search for it
+        home_dir = current_vault().home_dir
+        discovered_file_path = get_file_path_from_vault(notename, home_dir)
+        if not discovered_file_path:
+            raise FileNotFoundError(
+                f"Unable to locate file {filename} in vault {home_dir}")
+        filename = discovered_file_path[0]
+    return filename
+
+
+def get_file_content(notename: str, directory=None) -> IO:
+    """get file content from filename, from directory
 
+    """
+    vault = current_vault()
+    if directory is None:
+        directory = vault.dn_dir
+    try:
+        filename = f"{directory}/{notename}.md"
+        if vault.transaction is not None:
+            staged_content = vault.transaction.staged_content(filename)
+            if staged_content is not None:
+                return staged_content.rstrip()
+        filename = _locate_note(notename, directory)
+
+        with open(filename, "r+") as f:
+            content = f.read()
+            if profiler.enabled:
+                profiler.count("files_read")
+                profiler.count("bytes_read", os.fstat(f.fileno()).st_size)
+        return content.rstrip()
+    except Exception as e:
+        dlogger.error(f"Unable to get file {filename} content: {e}")
+        traceback.print_exc()
+        sys.exit(1)
 
-def get_file_content(notename: str, directory=DN_DIR) -> IO:
-    """get file content from filename, from directory
 
+def read_note_segments(notename: str, directory=None) -> Iterator[str]:
+    """The same text as get_file_content, as runs of whole lines read a
+    chunk at a time, so that memory stays bounded however big the note is
     """
+    vault = current_vault()
+    if directory is None:
+        directory = vault.dn_dir
     try:
         filename = f"{directory}/{notename}.md"
-        filePath = pathlib.Path(filename)
-        if not filePath.is_file():
-            # it's possible the file changes dirs, so search for it
-            discovered_file_path = get_file_path_from_vault(notename, HOME_DIR)
-            if not discovered_file_path:
-                raise FileNotFoundError(
-                    f"Unable to locate file {filename} in vault {HOME_DIR}")
-            filename = discovered_file_path[0]
-
-        return open(filename, "r+").read().rstrip()
+        if vault.transaction is not None:
+            staged_content = vault.transaction.staged_content(filename)
+            if staged_content is not None:
+                yield staged_content.rstrip()
+                return
+        filename = _locate_note(notename, directory)
+
+        with open(filename, "r") as f:
+            if profiler.enabled:
+                profiler.count("files_read")
+                profiler.count("bytes_read", os.fstat(f.fileno()).st_size)
+            yield from read_segments(f)
     except Exception as e:
         dlogger.error(f"Unable to get file {filename} content: {e}")
         traceback.print_exc()
         sys.exit(1)
 
 
-def find_pattern_in_file(notename: str, pattern, dir_path=None) -> List[Todo]:
+def _counting_lines(segments: Iterator[str]) -> Iterator[str]:
+    for segment in segments:
+        profiler.count("lines_scanned", segment.count("\n") + 1)
+        yield segment
+
+
+def get_parse_cache() -> ParseCache:
+    vault = current_vault()
+    if vault.parse_cache is None:
+        vault.parse_cache = ParseCache(vault.parse_cache_file, vault.dn_dir)
+        vault.parse_cache.load()
+    return vault.parse_cache
+
+
+def save_parse_cache():
+    vault = current_vault()
+    parse_cache = vault.parse_cache
+    if parse_cache is None:
+        return
+    if vault.run.persist:
+        parse_cache.save()
+    stats = parse_cache.take_stats()
+    for name, count in stats.items():
+        profiler.count(f"parse_cache_{name}", count)
+    dlogger.info(parse_cache.report(stats))
+
+
+def _cached_note_path(notename: str, directory: str) -> str:
+    """Where the note is on disk, None for a note that is staged or can't
+    be found, those aren't cached"""
+    transaction = current_vault().transaction
+    if (transaction is not None and transaction.staged_content(
+            f"{directory}/{notename}.md") is not None):
+        return None
+    try:
+        return _locate_note(notename, directory)
+    except FileNotFoundError:
+        return None
+
+
+def scan_note(notename: str, directory=None) -> Iterator[TodoRecord]:
+    """The open todos of a note, from the parse cache when the note wasn't
+    touched since it was last scanned, streamed from the note otherwise"""
+    if directory is None:
+        directory = current_vault().dn_dir
+    path = _cached_note_path(notename, directory)
+    if path is not None:
+        parse_cache = get_parse_cache()
+        stamp = file_stamp(path)
+        records = parse_cache.lookup(path, stamp)
+        if records is not None:
+            yield from records
+            return
+    segments = read_note_segments(notename, directory)
+    if profiler.enabled:
+        segments = _counting_lines(segments)
+    if path is None:
+        yield from scan_todo_segments(segments)
+        return
+    hasher = content_hasher()
+    records = []
+    for record in scan_todo_segments(hashing_segments(segments, hasher)):
+        records.append(record)
+        yield record
+    parse_cache.store(path, stamp, hasher.digest(), records)
+
+
+def iter_pattern_in_file(notename: str, pattern, dir_path=None
+                         ) -> Iterator[Todo]:
     """
     Filters the text within the note content to find matching lines against
     something that looks similar to - [ ] <todo text>
+    The note is streamed, todos are yielded as they are found
     """
-    matching_lines = []
-    note_text = get_file_content(notename, dir_path)
-    for line in note_text.split("\n"):
-        m = re.search(pattern, line)
-        if m and m.group(0):
-            matching_lines.append(
-                Todo(raw_text=m.group(0),
-                     notename=notename,
-                     front_spaces=m.group(1),
-                     todo_marker=m.group(2),
-                     todo_shame=m.group(3),
-                     todo_text=m.group(4)))
-    return matching_lines
-
-
-def find_pattern_in_files(FILE_DIR: str, pattern: str) -> List[Todo]:
-    """find pattern in all files (not subdirectories) in FILE_DIR"""
-    matched_patterns = []
-    for root, d_name, f_names in os.walk(f"{DN_DIR}"):
-        for fname in f_names:
-            if fname.startswith("."):
-                # want to ignore hidden files
-                continue
-            notename = fname.split(".")[0]
-            matches = find_pattern_in_file(notename, pattern, root)
-            if matches:
-                matched_patterns.extend(matches)
-    return matched_patterns
+    if pattern == OPEN_TASK_PATTERN:
+        yield from _todos_from_records(scan_note(notename, dir_path),
+                                       notename)
+        return
+    segments = read_note_segments(notename, dir_path)
+    if profiler.enabled:
+        segments = _counting_lines(segments)
+    yield from _todos_in_segments(segments, notename, pattern)
+
 
+def _todos_from_records(records: Iterable[TodoRecord],
+                        notename: str) -> Iterator[Todo]:
+    for record in records:
+        profiler.count("todos_built")
+        yield Todo.from_record(record, notename)
 
-def format_todos_by_action(todos: List[str],
-                           original_note_name=None) -> List[str]:
+
+def _todos_in_segments(segments: Iterable[str], notename: str,
+                       pattern) -> Iterator[Todo]:
+    if pattern == OPEN_TASK_PATTERN:
+        yield from _todos_from_records(scan_todo_segments(segments),
+                                       notename)
+        return
+    for segment in segments:
+        for line in segment.split("\n"):
+            m = re.search(pattern, line)
+            if m and m.group(0):
+                yield Todo(raw_text=m.group(0),
+                           notename=notename,
+                           front_spaces=m.group(1),
+                           todo_marker=m.group(2),
+                           todo_shame=m.group(3),
+                           todo_text=m.group(4))
+
+
+def find_pattern_in_file(notename: str, pattern, dir_path=None) -> List[Todo]:
+    return list(iter_pattern_in_file(notename, pattern, dir_path))
+
+
+def format_todo(todo: Todo, indent: str) -> str:
+    """The todo as a line of the new note, indented by indent, None when it
+    is to be left out. The upcoming shame is only looked at for the actions
+    that show it, a NOOP todo never gets its next action planned"""
+    if todo.action == Action.SHAME:
+        return f"{indent}- [ ] {todo.upcoming_shame} {todo.text}"
+    elif todo.action == Action.FUTURE:
+        # if the future todos are to be hidden from the DN
+        if HIDE_FUTURE_TODOS_FROM_DAILY_NOTE:
+            return None
+        else:
+            return f"{indent}- [ ] {todo.upcoming_shame} {todo.text}"
+    elif todo.action == Action.ARCHIVE:
+        # add a backlink to original note
+        return f"{indent}- [ ] {todo.text}"
+    elif todo.action == Action.NOOP:
+        # make sure that the marker for the todo is not moved
+        # for backlinked todos, can be solved better by managing
+        # state of the todo
+        moved_to_open = todo.raw_text.replace("[>]", "[ ]")
+        moved_to_open = moved_to_open.split(
+            f"[[{todo.start_date_note}]]")[0].rstrip()
+        return f"{indent}{moved_to_open[len(todo.front_spaces):]}"
+
+
+def format_todos_by_action(todos: List[TodoNode],
+                           original_note_name=None,
+                           root_indent: str = None) -> List[str]:
     """Format todos for the new note
     This is needed because of the need to have the best possible
     information infront of me. Tasks that are meant for a future day
-    are not presented today. Spaces are respected so sub-lists order can be
-    maintained
+    are not presented today. Subtasks stay under their parents, the
+    subtasks of a todo that is left out take its place. The roots keep
+    their own indentation, or are all indented by root_indent when given,
+    subtasks keep theirs relative to their root
     """
     formatted_todos = []
-    for todo in todos:
-        new_todo = f"{todo.front_spaces}- [ ] {todo.upcoming_shame} {todo.text}"
-        if todo.action == Action.SHAME:
-            formatted_todos.append(new_todo)
-        elif todo.action == Action.FUTURE:
-            # if the future todos are to be hidden from the DN
-            if HIDE_FUTURE_TODOS_FROM_DAILY_NOTE:
-                continue
-            else:
-                formatted_todos.append(new_todo)
-        elif todo.action == Action.ARCHIVE:
-            # add a backlink to original note
-            new_todo = (f"{todo.front_spaces}- [ ] {todo.text}")
-            formatted_todos.append(new_todo)
-        elif todo.action == Action.NOOP:
-            # make sure that the marker for the todo is not moved
-            # for backlinked todos, can be solved better by managing
-            # state of the todo
-            moved_to_open = todo.raw_text.replace("[>]", "[ ]")
-            moved_to_open = moved_to_open.split(
-                f"[[{todo.start_date_note}]]")[0].rstrip()
-            formatted_todos.append(f"{moved_to_open}")
-
+    for root in todos:
+        _format_todo_node(
+            root, root.todo.front_spaces if root_indent is None else
+            root_indent, formatted_todos)
     return formatted_todos
 
 
-def write_file(notename, content, directory=DN_DIR):
-    """Write out file in daily note directory
+def _format_todo_node(node: TodoNode, indent: str, formatted_todos: List[str]):
+    formatted_todo = format_todo(node.todo, indent)
+    if formatted_todo is None:
+        for child in node.children:
+            _format_todo_node(child, indent, formatted_todos)
+        return
+    formatted_todos.append(formatted_todo)
+    parent_spaces = node.todo.front_spaces
+    for child in node.children:
+        child_spaces = child.todo.front_spaces
+        if child_spaces.startswith(parent_spaces):
+            child_spaces = child_spaces[len(parent_spaces):]
+        _format_todo_node(child, indent + child_spaces, formatted_todos)
+
+
+def write_file(notename, content, directory=None):
+    """Write out file in daily note directory, as part of the open
+    transaction or else in a transaction of its own
+    """
+    vault = current_vault()
+    if directory is None:
+        directory = vault.dn_dir
+    filename = f"{directory}/{notename}.md"
+    if vault.transaction is None:
+        transaction = NoteTransaction()
+        transaction.write(filename, content)
+        _log_commit(transaction)
+        return
+    vault.transaction.write(filename, content)
+    if vault.run_backlink_index is not None:
+        vault.run_backlink_index.update_note(filename, notename,
+                                             content.rstrip())
+    if vault.todo_db is not None and vault.todo_db.in_transaction:
+        vault.todo_db.update_note(filename, notename, content.rstrip())
+    if vault.schedule is not None:
+        vault.schedule.add_lines(
+            filename, notename,
+            index_note_lines([content], re.compile(OPEN_TASK_PATTERN)).values(),
+            note_ordinal)
+    dlogger.debug(f"Staged {len(content)} lines for {filename}")
+
+
+def append_file(notename, content, directory=None):
+    """Append content as new lines at the end of a note
     """
+    vault = current_vault()
+    if directory is None:
+        directory = vault.dn_dir
     filename = f"{directory}/{notename}.md"
-    with open(filename, "w+") as f:
-        f.write(content)
-    dlogger.info(f"Successfully wrote {len(content)} lines to {filename}")
+    if vault.transaction is None:
+        transaction = NoteTransaction()
+        transaction.append(filename, content)
+        _log_commit(transaction)
+        return
+    vault.transaction.append(filename, content)
+    if vault.schedule is not None:
+        vault.schedule.add_lines(
+            filename, notename,
+            index_note_lines([content], re.compile(OPEN_TASK_PATTERN)).values(),
+            note_ordinal)
+    dlogger.debug(f"Staged {len(content)} lines to append to {filename}")
+
+
+def _log_commit(transaction: NoteTransaction):
+    transaction.commit()
+    for filename in transaction.written:
+        dlogger.info(f"Successfully wrote {filename}")
+    for filename in transaction.skipped:
+        dlogger.info(f"{filename} is unchanged, skipped writing it")
+
+
+def begin_writes():
+    """Stage every write_file and append_file until commit_writes"""
+    vault = current_vault()
+    vault.transaction = NoteTransaction()
+    if vault.todo_db is not None:
+        vault.todo_db.begin()
+
+
+def abort_writes():
+    """Drop everything staged since begin_writes"""
+    vault = current_vault()
+    vault.transaction = None
+    vault.run_backlink_index = None
+    # it has seen the staged notes, it is loaded again from disk
+    vault.schedule = None
+    if vault.todo_db is not None and vault.todo_db.in_transaction:
+        vault.todo_db.rollback()
+    if vault.resident_backlink_index is not None:
+        # it has seen the staged notes, go back to what is on disk
+        refresh_resident_backlink_index()
+
+
+def commit_writes():
+    """Write out everything staged since begin_writes in one go, then save
+    the indexes that describe what is now on disk"""
+    vault = current_vault()
+    transaction, vault.transaction = vault.transaction, None
+    with profiler.phase("write"):
+        _log_commit(transaction)
+        if vault.todo_db is not None and vault.todo_db.in_transaction:
+            vault.todo_db.commit()
+    if vault.run_backlink_index is not None:
+        _feed_schedule(vault.run_backlink_index)
+        if vault.run.persist:
+            vault.run_backlink_index.save()
+        vault.run_backlink_index = None
+    if not vault.run.persist:
+        return
+    if vault.archive_index is not None:
+        vault.archive_index.sync()
+    if vault.schedule is not None:
+        vault.schedule.save()
+
+
+def get_render_engine() -> RenderEngine:
+    """One render engine per process and shared directory, templates are
+    compiled once for every vault that uses them. Dry runs don't keep the
+    compiled templates on disk"""
+    vault = current_vault()
+    key = (vault.shared_dir, vault.run.persist)
+    with _render_engines_lock:
+        render_engine = _render_engines.get(key)
+        if render_engine is None:
+            render_engine = RenderEngine(
+                vault.shared_dir,
+                TEMPLATE_BYTECODE_CACHE_DIR if vault.run.persist else None)
+            _render_engines[key] = render_engine
+    return render_engine
+
+
+def render_template(template_name: str, **context) -> str:
+    with profiler.phase("render"):
+        rendered = get_render_engine().render(template_name, **context)
+    profiler.count("templates_rendered")
+    return rendered
 
 
 def add_content_to_archive(filename, todos):
-    file_loader = FileSystemLoader(SCRIPT_DIR)
-    env = Environment(loader=file_loader)
-    template = env.get_template(ARCHIVE_TEMPLATE)
-    rendered_note = template.render(tasks=todos)
-    return rendered_note
+    return render_template(ARCHIVE_TEMPLATE, tasks=todos)
 
 
 def add_content_to_note_template(filename, todos):
     """Publish the filename content to daily note jinja template
     """
-    file_loader = FileSystemLoader(SCRIPT_DIR)
-    env = Environment(loader=file_loader)
-    template = env.get_template(JINJA_TEMPLATE)
-    note_date = get_date_from_note_name(filename)
-    tmrw_date = add_day_delta(note_date, 1)
-    tmrw_note_name = get_note_name_from_date(tmrw_date)
-    yester_date = add_day_delta(note_date, -1)
-    yester_note_name = get_note_name_from_date(yester_date)
-    quote = QuotesGetter().get_a_random_quote()
-    rendered_note = template.render(tasks=todos,
-                                    DN_DIR=DN_FOLDER,
-                                    yesterday_note_name=yester_note_name,
-                                    tomorrow_note_name=tmrw_note_name,
-                                    quote=quote)
-    return rendered_note
-
-
-def replace_open_with_moved_todos(notename):
+    note_day = get_date_from_note_name(filename).toordinal()
+    tmrw_note_name = get_calendar().note_name(note_day + 1)
+    yester_note_name = get_calendar().note_name(note_day - 1)
+    vault = current_vault()
+    quotes_file = f"{vault.shared_dir}/{QUOTES_FILE}"
+    with profiler.phase("quotes"):
+        quote = QuotesGetter(
+            quotes_file=quotes_file,
+            read_only=not vault.run.persist).get_a_random_quote()
+    return render_template(JINJA_TEMPLATE,
+                           tasks=todos,
+                           DN_DIR=DN_FOLDER,
+                           yesterday_note_name=yester_note_name,
+                           tomorrow_note_name=tmrw_note_name,
+                           quote=quote)
+
+
+class ParsedNote:
+    """A note read and scanned once, with the open todos in it and the
+    offsets of their markers, so that it never has to be read again in the
+    same run"""
+    __slots__ = ("notename", "text", "records")
+
+    def __init__(self, notename: str, directory=None, todo_db=None):
+        directory = directory or current_vault().dn_dir
+        self.notename = notename
+        path = _cached_note_path(notename, directory)
+        stamp = file_stamp(path) if path is not None else None
+        self.text = get_file_content(notename, directory)
+        # the records are only reused for the very text that was read, the
+        # marker offsets in them are spliced into it when todos are moved
+        note_hash = content_hash(self.text)
+        if todo_db is not None:
+            self.records = todo_db.note_records(notename, note_hash)
+            if self.records is not None:
+                return
+        if path is not None:
+            parse_cache = get_parse_cache()
+            self.records = parse_cache.lookup_content(path, stamp, note_hash)
+            if self.records is not None:
+                return
+        self.records = list(scan_todos(self.text))
+        if profiler.enabled:
+            profiler.count("lines_scanned", self.text.count("\n") + 1)
+        if path is not None:
+            parse_cache.store(path, stamp, note_hash, self.records)
+
+    def todos(self) -> List[Todo]:
+        todos = [
+            Todo.from_record(record, self.notename) for record in self.records
+        ]
+        profiler.count("todos_built", len(todos))
+        return todos
+
+    def with_moved_todos(self) -> str:
+        """The note text with every open [ ] todo marked as moved [>]"""
+        pieces = []
+        last_offset = 0
+        for record in self.records:
+            if not record.marker.isspace():
+                continue
+            pieces.append(self.text[last_offset:record.marker_offset])
+            pieces.append(">")
+            last_offset = record.marker_offset + 1
+        pieces.append(self.text[last_offset:])
+        return "".join(pieces)
+
+
+def replace_open_with_moved_todos(notename, parsed_note: ParsedNote = None):
     """Replace open [ ] with moved todo symbol [>]
-    to differentiate between open and close todos
+    to differentiate between open and close todos, only todo markers are
+    touched
     """
-    note = get_file_content(notename)
-    modified_content = re.sub(r"\[\s\]", r"[>]", note)
-    return modified_content
+    if parsed_note is None:
+        parsed_note = ParsedNote(notename)
+    return parsed_note.with_moved_todos()
 
 
-def get_open_todos(notename: str):
+def get_open_todos(notename: str, parsed_note: ParsedNote = None):
     """Get todos with the pattern [ ]
     """
-    open_todos = find_pattern_in_file(notename, OPEN_TASK_PATTERN, DN_DIR)
+    if parsed_note is None:
+        # nothing is rewritten, so the note can be streamed
+        open_todos = find_pattern_in_file(notename, OPEN_TASK_PATTERN)
+    else:
+        open_todos = parsed_note.todos()
     # check if there are any backlinked todos:
     dlogger.info(f"{len(open_todos)} open todos found in {notename}.md")
     return open_todos
 
 
+def get_backlink_index() -> BacklinkIndex:
+    """Load the persisted backlink index, and re-read only the daily notes
+    that changed since it was last saved. While a transaction is open (for
+    the whole range of a batch run) the vault is scanned once, and the index
+    is kept up to date with the staged writes after that
+    """
+    vault = current_vault()
+    if vault.run_backlink_index is not None:
+        return vault.run_backlink_index
+    if vault.resident_backlink_index is not None:
+        # the server keeps it current, see refresh_resident_backlink_index
+        index = vault.resident_backlink_index
+    else:
+        with profiler.phase("index_refresh"):
+            index = BacklinkIndex(vault.backlink_index_file, vault.dn_dir,
+                                  OPEN_TASK_PATTERN)
+            index.load()
+            index.refresh(read_note_segments,
+                          jobs=vault.run.jobs,
+                          pool=vault.run.pool)
+        dlogger.info(f"Backlink index re-read {index.files_read} of "
+                     f"{len(index.files)} notes")
+    if vault.transaction is not None:
+        vault.run_backlink_index = index
+    else:
+        _feed_schedule(index)
+        if vault.run.persist:
+            index.save()
+    return index
+
+
+def hold_backlink_index():
+    """Keep the backlink index in memory across runs instead of loading it
+    for every run, for a long running process"""
+    vault = current_vault()
+    vault.resident_backlink_index = None
+    vault.resident_backlink_index = get_backlink_index()
+
+
+def refresh_resident_backlink_index() -> int:
+    """Re-read the notes that changed on disk since the last refresh, and
+    return how many were read"""
+    vault = current_vault()
+    index = vault.resident_backlink_index
+    files_read = index.files_read
+    with profiler.phase("index_refresh"):
+        index.refresh(read_note_segments,
+                      jobs=vault.run.jobs,
+                      pool=vault.run.pool)
+    _feed_schedule(index)
+    if vault.run.persist:
+        index.save()
+    return index.files_read - files_read
+
+
+def get_schedule(build: bool = False) -> Schedule:
+    """The schedule of the vault, loaded once per run. A vault without one
+    gets it built from the backlink index when build is set, and None
+    otherwise, runs without --schedule only keep an existing one up to date
+    """
+    vault = current_vault()
+    if vault.schedule is not None:
+        return vault.schedule
+    schedule = Schedule(vault.schedule_file, vault.dn_dir)
+    schedule.load()
+    if not schedule.loaded:
+        if not build:
+            return None
+        with profiler.phase("schedule_build"):
+            index = get_backlink_index()
+            for path, entry in index.files.items():
+                schedule.add_lines(path, entry["notename"],
+                                   entry["lines"].values(), note_ordinal)
+            index.reindexed.clear()
+        schedule.dirty = True
+        dlogger.info(f"Built the schedule from {len(index.files)} notes")
+    vault.schedule = schedule
+    if vault.transaction is None and vault.run.persist:
+        schedule.save()
+    return schedule
+
+
+def get_fresh_schedule() -> Tuple[Schedule, BacklinkIndex]:
+    """The schedule, with the links of every note edited since it was last
+    fed, and the backlink index it was fed from. The index checks every
+    note against its mtime/size stamp and re-reads only the changed ones,
+    so that a link added by hand to any note is found"""
+    index = get_backlink_index()
+    schedule = get_schedule(build=True)
+    _feed_schedule(index)
+    return schedule, index
+
+
+def _feed_schedule(index: BacklinkIndex):
+    """Add the links of the notes the index read since the last time"""
+    vault = current_vault()
+    schedule = get_schedule()
+    if schedule is not None:
+        for path in index.reindexed:
+            entry = index.files.get(path)
+            if entry is not None:
+                schedule.add_lines(path, entry["notename"],
+                                   entry["lines"].values(), note_ordinal)
+        if vault.transaction is None and vault.run.persist:
+            schedule.save()
+    index.reindexed.clear()
+
+
+def scheduled_backlinks(notename: str, sources,
+                        index: BacklinkIndex) -> Iterator[tuple]:
+    """(source notename, line) for the todos linking to notename in the
+    notes the schedule has for it. The lines come from the index, which was
+    just brought up to date, so the notes are never read again"""
+    for path, src_note in sources:
+        entry = index.files.get(path)
+        if entry is None:
+            # gone since the schedule saw it
+            continue
+        for line in entry["lines"].values():
+            if notename in LINK_PATTERN.findall(line):
+                yield src_note, line
+
+
 def get_backlink_todos(notename: str):
     """backlinked todos will have a date set to future, so if their start date is
     the note for which the todos are being created, then their action should be
     NOOP
     """
-    pattern = OPEN_TASK_PATTERN + f"\[\[({notename})\]\]"
-    backlink_todos = find_pattern_in_files(DN_DIR, pattern)
+    vault = current_vault()
+    backlink_todos = []
+    if vault.todo_db is not None:
+        backlinks = vault.todo_db.backlinks(notename)
+    elif vault.run.schedule:
+        schedule, index = get_fresh_schedule()
+        day = note_ordinal(notename)
+        if schedule.covers(day):
+            schedule.pop_due(day)
+            backlinks = scheduled_backlinks(notename,
+                                            schedule.sources(notename), index)
+        else:
+            # popped too long ago, the schedule forgot where its links are
+            backlinks = index.lookup(notename)
+    else:
+        backlinks = get_backlink_index().lookup(notename)
+        schedule = get_schedule()
+        if schedule is not None:
+            # keeps the heap down to the days still to come
+            schedule.pop_due(note_ordinal(notename))
+    for src_note, line in backlinks:
+        record = scan_backlink(line, notename)
+        if record:
+            backlink_todos.append(Todo.from_record(record, src_note))
+    profiler.count("todos_built", len(backlink_todos))
+    profiler.count("backlinks_found", len(backlink_todos))
     dlogger.info(
         f"{len(backlink_todos)} backlinked todo(s) found for note {notename}")
     for todo in backlink_todos:
@@ -374,62 +1070,280 @@ def get_backlink_todos(notename: str):
 
 
 def render_archive_template(todos, template=ARCHIVE_TEMPLATE):
-    file_loader = FileSystemLoader(SCRIPT_DIR)
-    env = Environment(loader=file_loader)
-    template = env.get_template(template)
-    rendered_note = template.render(tasks=todos)
-    return rendered_note
+    return render_template(template, tasks=todos)
 
 
-def get_current_archived_todos(to_be_archived_todos,
+def get_current_archived_todos(to_be_archived_todos=None,
                                notename=ARCHIVE_NOTE_NAME):
     # format these existing_todos by getting the open todos in archive
     todos_in_archive = get_open_todos(notename)
     dlogger.info(f"Found {len(todos_in_archive)} todos in current archive..")
-    dlogger.debug(f"Currently Archives todos are {todos_in_archive}")
+    dlogger.debug("Currently Archives todos are %s", todos_in_archive)
     return todos_in_archive
 
 
+def get_archive_index() -> ArchiveIndex:
+    """The todos already in the Archive note, the Archive itself is only
+    read when it was changed outside of this script"""
+    vault = current_vault()
+    if vault.archive_index is None:
+        archive_file = f"{vault.archive_note_dir}/{ARCHIVE_NOTE_NAME}.md"
+        vault.archive_index = ArchiveIndex(vault.archive_index_file,
+                                           archive_file)
+        vault.archive_index.load(lambda: [
+            todo.fingerprint for todo in get_current_archived_todos()
+        ] if os.path.isfile(archive_file) else [])
+    return vault.archive_index
+
+
+def get_new_archive_todos(
+        to_be_archived_todos: List[TodoNode]) -> List[TodoNode]:
+    """Drop the todos that are already in the Archive, or that come up twice
+    among their siblings. The subtasks of a dropped todo are still archived,
+    in its place
+    """
+    return _new_archive_nodes(to_be_archived_todos, get_archive_index(),
+                              set())
+
+
+def _new_archive_nodes(nodes: List[TodoNode], archive_index: ArchiveIndex,
+                       seen: set) -> List[TodoNode]:
+    new_nodes = []
+    for node in nodes:
+        fingerprint = node.todo.fingerprint
+        if fingerprint in archive_index or fingerprint in seen:
+            # the subtasks take its place, among its siblings
+            new_nodes += _new_archive_nodes(node.children, archive_index,
+                                            seen)
+            continue
+        seen.add(fingerprint)
+        node.children = _new_archive_nodes(node.children, archive_index,
+                                           set())
+        new_nodes.append(node)
+    return new_nodes
+
+
+def add_to_archive(todos: List[Todo], formatted_todos: List[str]):
+    """Append the formatted todos to the end of the Archive note, an Archive
+    that doesn't exist yet is started from the archive template"""
+    vault = current_vault()
+    archive_file = f"{vault.archive_note_dir}/{ARCHIVE_NOTE_NAME}.md"
+    if not formatted_todos:
+        return
+    if os.path.isfile(archive_file) or (
+            vault.transaction is not None
+            and vault.transaction.staged_content(archive_file) is not None):
+        append_file(ARCHIVE_NOTE_NAME, "\n".join(formatted_todos),
+                    vault.archive_note_dir)
+    else:
+        write_file(ARCHIVE_NOTE_NAME, render_archive_template(formatted_todos),
+                   vault.archive_note_dir)
+    get_archive_index().add(todo.fingerprint for todo in todos)
+
+
+def compact_archive(config: Dict[str, Union[str, bool]]):
+    """Rebuild the Archive note from scratch, this drops the duplicates and
+    tidies up whatever was appended or edited by hand"""
+    vault = current_vault()
+    vault.run.persist = not config["disable_writes"]
+    archived_todos = dedupe_todo_forest(
+        build_todo_forest(get_current_archived_todos()))
+    archive_content = render_archive_template(
+        format_todos_by_action(archived_todos, root_indent=""))
+    if config["disable_writes"]:
+        dlogger.info(archive_content)
+        return
+    write_file(ARCHIVE_NOTE_NAME, archive_content, vault.archive_note_dir)
+    vault.archive_index = ArchiveIndex(
+        vault.archive_index_file,
+        f"{vault.archive_note_dir}/{ARCHIVE_NOTE_NAME}.md")
+    vault.archive_index.rebuild(
+        todo.fingerprint for todo in iter_todo_forest(archived_todos))
+    vault.archive_index.sync()
+    dlogger.info(f"Compacted archive down to "
+                 f"{sum(1 for _ in iter_todo_forest(archived_todos))} todos")
+    save_parse_cache()
+
+
 def deduplicate_todos(todos: List[Todo]):
     """Remove duplicates
     """
     dedup_todos = []
     seen = set()
     for todo in todos:
-        thash = hash(todo.text)
-        if thash in seen:
+        if todo.fingerprint in seen:
             continue
         else:
             dedup_todos.append(todo)
-            seen.add(thash)
-    dlogger.debug(f"Post deduplication, todos look like this {dedup_todos}")
+            seen.add(todo.fingerprint)
+    # left to logging to format, so that the todos aren't planned for it
+    dlogger.debug("Post deduplication, todos look like this %s", dedup_todos)
     return dedup_todos
 
 
-def filter_todos_by_action(todos: List[Todo],
-                           include_action: Action = None,
-                           exclude_action: Action = None):
-    if not include_action and not exclude_action:
-        return todos
-    if include_action:
-        return [todo for todo in todos if todo.action == include_action]
-    if exclude_action:
-        return [todo for todo in todos if todo.action != exclude_action]
+# siblings are ordered shame first, next noop, next future, followed by
+# archive
+ACTION_ORDER = [Action.SHAME, Action.NOOP, Action.FUTURE, Action.ARCHIVE]
 
 
-def reorder_todos(today_todos: List[Todo]):
-    # shame first, next noop, next future, followed by archive
-    shamed_todos = filter_todos_by_action(today_todos,
-                                          include_action=Action.SHAME)
-    # for daily notes, noop would be stickied todos
-    noop_todos = filter_todos_by_action(today_todos,
-                                        include_action=Action.NOOP)
-    archived_todos = filter_todos_by_action(today_todos,
-                                            include_action=Action.ARCHIVE)
-    future_todos = filter_todos_by_action(today_todos,
-                                          include_action=Action.FUTURE)
+def plan_todo_forest(roots: List[TodoNode],
+                     reorder: bool = True,
+                     head: List[Todo] = ()):
+    """Split a todo forest into what goes to the next note and what goes to
+    the Archive, in one pass. A todo to archive takes its subtasks along,
+    duplicates are dropped among siblings only, and with reorder siblings
+    are reordered by action with their subtasks staying under them.
+    head todos come first in the next note, as they are
+    Returns the forest for the next note and the archived subtrees
+    """
+    archived = []
+    kept = [TodoNode(todo) for todo in deduplicate_todos(list(head))]
+    seen = {node.todo.fingerprint for node in kept}
+    kept += _plan_siblings(roots, reorder, archived, seen)
+    return kept, archived
+
+
+def _plan_siblings(nodes: List[TodoNode], reorder: bool,
+                   archived: List[TodoNode], seen: set) -> List[TodoNode]:
+    buckets = {action: [] for action in ACTION_ORDER}
+    for node in nodes:
+        if node.todo.action == Action.ARCHIVE:
+            for todo in iter_todo_forest(node.children):
+                todo.set_action(Action.ARCHIVE)
+            archived.append(node)
+            continue
+        if node.todo.fingerprint in seen:
+            continue
+        seen.add(node.todo.fingerprint)
+        node.children = _plan_siblings(node.children, reorder, archived,
+                                       set())
+        buckets[node.todo.action if reorder else Action.SHAME].append(node)
+    return [node for action in ACTION_ORDER for node in buckets[action]]
 
-    return shamed_todos + noop_todos + future_todos + archived_todos
+
+def dedupe_todo_forest(roots: List[TodoNode]) -> List[TodoNode]:
+    """Drop the todos that come up twice under the same parent"""
+    deduped = []
+    seen = set()
+    for node in roots:
+        if node.todo.fingerprint in seen:
+            continue
+        seen.add(node.todo.fingerprint)
+        node.children = dedupe_todo_forest(node.children)
+        deduped.append(node)
+    return deduped
+
+
+def read_todo_rows(notename: str, root: str) -> List[tuple]:
+    """The open todos of a note as rows of the todo store"""
+    rows = []
+    for todo in iter_pattern_in_file(notename, OPEN_TASK_PATTERN, root):
+        target = 0
+        if todo.start_date_note:
+            target = note_ordinal(todo.start_date_note) or 0
+        rows.append((indent_width(todo.front_spaces), todo.marker[1:-1],
+                     len(todo.shame), target, todo.text))
+    return rows
+
+
+def get_todo_store() -> TodoStore:
+    """Load the todo store, and re-read only the daily notes that changed
+    since it was last saved"""
+    vault = current_vault()
+    with profiler.phase("store_refresh"):
+        store = TodoStore(vault.todo_store_file, vault.dn_dir)
+        store.load()
+        files_read = store.refresh(read_todo_rows, note_ordinal)
+        if vault.run.persist:
+            store.save()
+    save_parse_cache()
+    dlogger.info(f"Todo store re-read {files_read} of {len(store.files)} "
+                 f"notes")
+    return store
+
+
+def _ordinal(date: datetime.date) -> int:
+    return date.toordinal() if date else None
+
+
+def _as_date(text: str) -> datetime.date:
+    return datetime.date.fromisoformat(text) if text else None
+
+
+def query_todos(start_date: datetime.date = None,
+                end_date: datetime.date = None,
+                action: Action = None,
+                min_shame: int = 0,
+                max_shame: int = None,
+                scheduled_from: datetime.date = None,
+                scheduled_to: datetime.date = None) -> List[Todo]:
+    """Open todos across the daily notes, from notes dated between
+    start_date and end_date and with a start date link between
+    scheduled_from and scheduled_to, every bound is optional. action is
+    planned as of today, the way the next note would see the todo
+    """
+    store = get_todo_store()
+    todos = []
+    for row in store.select(start=_ordinal(start_date),
+                            end=_ordinal(end_date),
+                            target_start=_ordinal(scheduled_from),
+                            target_end=_ordinal(scheduled_to),
+                            min_shame=min_shame,
+                            max_shame=max_shame):
+        values = store.row(row)
+        start_date_note = None
+        if values["target"]:
+            start_date_note = get_calendar().note_name(values["target"])
+        todo = Todo(raw_text="",
+                    notename=get_calendar().note_name(values["date"]),
+                    front_spaces=" " * values["indent"],
+                    todo_marker=values["marker"],
+                    todo_shame=SHAME_CHAR * values["shame"],
+                    todo_text=values["text"],
+                    start_date_note=start_date_note)
+        if action is not None and todo.action != action:
+            continue
+        todos.append(todo)
+    return todos
+
+
+def query_from_args(args: argparse.Namespace):
+    """Print the todos the query options ask for, one per line"""
+    _configure_logger()
+    if args.z:
+        dlogger.setLevel(level=logging.DEBUG)
+    current_vault().run.reset()
+    todos = query_todos(start_date=_as_date(args.query_from),
+                        end_date=_as_date(args.query_to),
+                        action=Action[args.action.upper()]
+                        if args.action else None,
+                        min_shame=args.min_shame,
+                        max_shame=args.max_shame,
+                        scheduled_from=_as_date(args.scheduled_from),
+                        scheduled_to=_as_date(args.scheduled_to))
+    for todo in todos:
+        start_date = (f" [[{todo.start_date_note}]]"
+                      if todo.start_date_note else "")
+        print(f"{todo.src_note} {todo.marker} {todo.shame} "
+              f"{todo.text}{start_date}")
+
+
+def upcoming_from_args(args: argparse.Namespace):
+    """Print the todos linking to the next few days, as the schedule has
+    them, one per line"""
+    _configure_logger()
+    if args.z:
+        dlogger.setLevel(level=logging.DEBUG)
+    run = current_vault().run
+    run.reset()
+    start = _as_date(args.upcoming_from) or run.today
+    schedule, index = get_fresh_schedule()
+    entries = schedule.upcoming(start.toordinal(),
+                                start.toordinal() + args.days)
+    for _, target, path, src_note in entries:
+        for _, line in scheduled_backlinks(target, [(path, src_note)],
+                                           index):
+            print(f"{target} {src_note} {line.strip()}")
 
 
 def daterange(start_date, end_date):
@@ -452,50 +1366,89 @@ def generate_daily_note(config: Dict[str, Union[str, bool]]):
     yesterday_note_name = get_note_name_for(config["current_datetime"],
                                             timedelta=-1)
 
-    yesterday_todos = get_open_todos(yesterday_note_name)
-    # reorder by what feels best
-    if not PRESERVE_ORDER:
-        yesterday_todos = reorder_todos(yesterday_todos)
-    backlinked_todos = get_backlink_todos(today_note_name)
-    # Add todos to tomorrow's note and write it out to a file
-    tmrw_todos_dedup = deduplicate_todos(
-        backlinked_todos +
-        filter_todos_by_action(yesterday_todos, exclude_action=Action.ARCHIVE))
-    formatted_tmrw_todos = format_todos_by_action(tmrw_todos_dedup)
+    # yesterday's note is read once, for its todos and for moving them
+    with profiler.phase("parse_yesterday"):
+        yesterday_note = ParsedNote(yesterday_note_name,
+                                    todo_db=current_vault().todo_db)
+        yesterday_todos = get_open_todos(yesterday_note_name, yesterday_note)
+    with profiler.phase("backlinks"):
+        backlinked_todos = get_backlink_todos(today_note_name)
+    # subtasks stay under their parents, siblings are reordered by what
+    # feels best and the todos to archive are split off with their subtasks
+    tmrw_todos, to_be_archived_todos = plan_todo_forest(
+        build_todo_forest(yesterday_todos),
+        reorder=not PRESERVE_ORDER,
+        head=backlinked_todos)
+    formatted_tmrw_todos = format_todos_by_action(tmrw_todos)
     templatified_note = add_content_to_note_template(today_note_name,
                                                      formatted_tmrw_todos)
     # Make sure that we close out on pending tasks
-    modified_today_note = replace_open_with_moved_todos(yesterday_note_name)
+    modified_today_note = replace_open_with_moved_todos(
+        yesterday_note_name, yesterday_note)
 
     # Now add stuff to archive
-    # this involves, getting the current todos->combining them with new
-    # archived todos -> removing duplicates -> formatting them -> adding to
-    # archive template -> write file
-    to_be_archived_todos = filter_todos_by_action(
-        yesterday_todos, include_action=Action.ARCHIVE)
-    current_archived_todos = get_current_archived_todos(to_be_archived_todos)
-    all_archive_todos = current_archived_todos + to_be_archived_todos
+    # this involves, dropping the todos that are already archived ->
+    # formatting the rest -> appending them to the archive note
+    with profiler.phase("archive"):
+        new_archived_todos = get_new_archive_todos(to_be_archived_todos)
     dlogger.debug(
-        f"[Archive] Current todos={len(current_archived_todos)},total todos={len(all_archive_todos)}"
+        f"[Archive] To be archived todos={len(to_be_archived_todos)},new todos={len(new_archived_todos)}"
     )
-    print(to_be_archived_todos)
-    dedup_archived_todos = deduplicate_todos(all_archive_todos)
-    dedup_archived_todos_formatted = format_todos_by_action(
-        dedup_archived_todos, yesterday_note_name)
-    archive_content = render_archive_template(dedup_archived_todos_formatted)
+    if dlogger.isEnabledFor(logging.DEBUG):
+        dlogger.debug("archiving %s",
+                      list(iter_todo_forest(to_be_archived_todos)))
+    # subtrees split off from a parent that stays open start at the top of
+    # the Archive, not under whatever entry comes before them
+    new_archived_todos_formatted = format_todos_by_action(
+        new_archived_todos, yesterday_note_name, root_indent="")
 
     if config["disable_writes"]:
         dlogger.info(templatified_note)
         return
 
+    todo_db = current_vault().todo_db
+    if todo_db is not None:
+        todo_db.record_history(
+            today_note_name,
+            ((todo.fingerprint, todo.src_note, todo.action.name,
+              len(todo.upcoming_shame), todo.start_date_note)
+             for todo in yesterday_todos))
+
     if config["only_write_to_archive"]:
-        write_file(ARCHIVE_NOTE_NAME, archive_content)
+        add_to_archive(list(iter_todo_forest(new_archived_todos)),
+                       new_archived_todos_formatted)
 
     if config["only_write_to_daily_notes"]:
         write_file(today_note_name, templatified_note)
         write_file(yesterday_note_name, modified_today_note)
 
 
+def open_todo_db():
+    """Open the todo database of the vault, and reconcile it with the notes
+    edited since the last run. A dry run works on a copy in memory. The
+    database stays with the thread that opened it
+    """
+    vault = current_vault()
+    todo_db = vault.todo_db
+    if todo_db is not None and todo_db.read_only == vault.run.persist:
+        close_todo_db()
+    if vault.todo_db is None:
+        vault.todo_db = TodoDatabase(vault.todo_db_file,
+                                     vault.dn_dir,
+                                     read_only=not vault.run.persist)
+    with profiler.phase("reconcile"):
+        files_read, parsed = vault.todo_db.reconcile(get_file_content)
+    dlogger.info(f"Todo database re-read {files_read} notes, "
+                 f"{parsed} of them had changed")
+
+
+def close_todo_db():
+    vault = current_vault()
+    if vault.todo_db is not None:
+        vault.todo_db.close()
+        vault.todo_db = None
+
+
 def generate_daily_notes(config: Dict[str, Union[str, bool]]):
     """
     The launchctl facility in macOS has a peculiarity where if the
@@ -508,7 +1461,10 @@ def generate_daily_notes(config: Dict[str, Union[str, bool]]):
     todos for 18th means no todos for 19th.
     Specified two config options -s and -d, which let the user specify the start
     and end dates as a range to generate notes for
+    With the batch option, the vault is scanned once for the whole range, and
+    the notes plus the final Archive are written out together at the end
     """
+    vault = current_vault()
     start_date = datetime.datetime.strptime(config["start_datetime"],
                                             "%Y-%m-%d")
     end_date = datetime.datetime.strptime(config["end_datetime"], "%Y-%m-%d")
@@ -517,9 +1473,41 @@ def generate_daily_notes(config: Dict[str, Union[str, bool]]):
     if start_date != end_date:
         start_date += datetime.timedelta(-1)
     end_date += datetime.timedelta(1)
-    for single_date in daterange(start_date, end_date):
-        config["current_datetime"] = single_date.strftime("%Y-%m-%d")
-        generate_daily_note(config)
+    vault.archive_index = None
+    vault.schedule = None
+    vault.run.reset()
+    vault.run.jobs = config.get("jobs", 1)
+    vault.run.pool = config.get("pool", "thread")
+    vault.run.schedule = config.get("schedule", False)
+    vault.run.persist = not config["disable_writes"]
+    if config.get("sqlite"):
+        open_todo_db()
+    else:
+        close_todo_db()
+    # every note gets a write transaction of its own, a batch run shares one
+    # across the range
+    batch = config.get("batch")
+    try:
+        if batch:
+            begin_writes()
+        for single_date in daterange(start_date, end_date):
+            config["current_datetime"] = single_date.strftime("%Y-%m-%d")
+            if not batch:
+                begin_writes()
+            generate_daily_note(config)
+            if not batch:
+                commit_writes()
+        if batch:
+            commit_writes()
+    except BaseException:
+        abort_writes()
+        raise
+    save_parse_cache()
+    render_engine = _render_engines.get((vault.shared_dir, vault.run.persist))
+    if render_engine is not None:
+        dlogger.info(
+            f"Rendered {render_engine.render_count} templates in "
+            f"{render_engine.render_seconds * 1000:.2f}ms")
 
 
 def _configure_logger():
@@ -539,7 +1527,11 @@ def set_options_and_generate_notes(args: argparse.Namespace):
     and is a pretty ugly way to modify the args
     """
     _configure_logger()
-    today = datetime.date.today()
+    run_config(config_from_args(args))
+
+
+def config_from_args(args: argparse.Namespace) -> Dict[str, Union[str, bool]]:
+    """Turn the cli options into the config fed to generate_daily_notes"""
     config = {
         "start_datetime": args.start_day_date,
         "end_datetime": args.end_day_date,
@@ -547,6 +1539,14 @@ def set_options_and_generate_notes(args: argparse.Namespace):
         "disable_writes": False,
         "only_write_to_archive": True,
         "only_write_to_daily_notes": True,
+        "batch": False,
+        "jobs": 1,
+        "pool": "thread",
+        "compact_archive": False,
+        "profile": False,
+        "cprofile": False,
+        "sqlite": False,
+        "schedule": False,
     }
 
     if args:
@@ -556,14 +1556,48 @@ def set_options_and_generate_notes(args: argparse.Namespace):
             # other options
             dlogger.setLevel(level=logging.DEBUG)
 
+        if args and args.batch:
+            config["batch"] = True
+
+        if args and args.sqlite:
+            config["sqlite"] = True
+
+        if args and args.schedule:
+            config["schedule"] = True
+
+        if args and args.compact_archive:
+            config["compact_archive"] = True
+
+        if args and args.profile:
+            config["profile"] = True
+            config["cprofile"] = args.cprofile
+
+        if args and args.jobs:
+            config["jobs"] = args.jobs
+            config["pool"] = args.pool
+
         if args and args.no_write_out:
             config["disable_writes"] = True
         elif args and args.only_write_to_archive:
             config["only_write_to_daily_notes"] = False
         elif args and args.only_write_to_daily_notes:
             config["only_write_to_archive"] = False
+    return config
+
 
-    generate_daily_notes(config)
+def run_config(config: Dict[str, Union[str, bool]]):
+    """Generate the notes, or compact the archive, as config says"""
+    if config["profile"]:
+        profiler.start(with_cprofile=config["cprofile"])
+    try:
+        if config["compact_archive"]:
+            compact_archive(config)
+        else:
+            generate_daily_notes(config)
+    finally:
+        if config["profile"]:
+            report_file = profiler.stop(current_vault().profile_dir)
+            dlogger.info(f"Profile report written to {report_file}")
 
 
 if __name__ == "__main__":
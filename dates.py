@@ -0,0 +1,81 @@
+"""
+Note name <-> day conversions for a daily note format
+Days are day ordinals (datetime.date.toordinal), so that day arithmetic is
+integer arithmetic. The note names of the days around today are worked out
+once, in both directions, and any other name or day is converted the first
+time it comes up and remembered after that
+"""
+
+import datetime
+import re
+from typing import Dict, List, Optional
+
+# days either side of today in the precomputed table
+CALENDAR_DAYS = 183
+
+
+def note_name_pattern(date_pattern: str, date_format: str,
+                      name_format: str) -> str:
+    """Regex of the note names name_format writes, the date in them is
+    matched with date_pattern and the text around it literally"""
+    prefix, found, suffix = name_format.partition(date_format)
+    if not found:
+        # the date can't be told apart from the rest of the name
+        return r"[^\[\]]*(?:" + date_pattern + r")[^\[\]]*"
+    return re.escape(prefix) + "(?:" + date_pattern + ")" + re.escape(suffix)
+
+
+class NoteCalendar:
+    def __init__(self,
+                 date_pattern: str,
+                 date_format: str,
+                 name_format: str,
+                 today: datetime.date = None,
+                 days: int = CALENDAR_DAYS):
+        """date_pattern finds the date text in a note name, date_format is
+        what strptime parses that text with, and name_format is what
+        strftime writes a note name with"""
+        self.date_re = re.compile(date_pattern)
+        self.date_format = date_format
+        self.name_format = name_format
+        today = today or datetime.date.today()
+        self.first = today.toordinal() - days
+        self.names: List[str] = [
+            datetime.date.fromordinal(day).strftime(name_format)
+            for day in range(self.first, self.first + 2 * days + 1)
+        ]
+        # None for a name without a date in it
+        self.days: Dict[str, Optional[int]] = {
+            name: self.first + i
+            for i, name in enumerate(self.names)
+        }
+        self.other_names: Dict[int, str] = {}
+
+    def day(self, note_name: str) -> Optional[int]:
+        """Day ordinal of the note, None when there is no date in its name
+        """
+        try:
+            return self.days[note_name]
+        except KeyError:
+            day = self.days[note_name] = self._parse(note_name)
+            return day
+
+    def _parse(self, note_name: str) -> Optional[int]:
+        m = self.date_re.search(note_name)
+        if not m:
+            return None
+        try:
+            return datetime.datetime.strptime(m.group(0),
+                                              self.date_format).toordinal()
+        except ValueError:
+            return None
+
+    def note_name(self, day: int) -> str:
+        i = day - self.first
+        if 0 <= i < len(self.names):
+            return self.names[i]
+        name = self.other_names.get(day)
+        if name is None:
+            name = self.other_names[day] = datetime.date.fromordinal(
+                day).strftime(self.name_format)
+        return name
@@ -0,0 +1,139 @@
+"""
+Transactional write-out of notes
+Notes are staged in memory and committed together: each one is written to a
+temp file next to it, all temp files are fsynced in one pass, then renamed
+over the originals, so a crash or a sync client never sees a half written
+note. Notes whose content is already on disk are skipped, so that Dropbox
+doesn't upload them again.
+Appends (the Archive) are written at the end of the file instead of
+rewriting it, an append can't truncate what is already there
+"""
+
+import os
+import logging
+from typing import Dict, List
+
+wlogger = logging.getLogger(__name__)
+
+
+def _is_unchanged(path: str, data: bytes) -> bool:
+    """Compare sizes first, and only read the file when they match"""
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _file_mode(path: str) -> int:
+    """Keep the permissions of the note being replaced"""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except OSError:
+        return 0o644
+
+
+def append_lines(last_char: str, content: str) -> str:
+    """content to append so that it starts on a line of its own"""
+    if not last_char or last_char == "\n":
+        return content
+    return f"\n{content}"
+
+
+class NoteTransaction:
+    def __init__(self):
+        # path -> full content
+        self.writes: Dict[str, str] = {}
+        # path -> content to append
+        self.appends: Dict[str, str] = {}
+        self.written: List[str] = []
+        self.skipped: List[str] = []
+
+    def write(self, path: str, content: str):
+        self.writes[path] = content
+        self.appends.pop(path, None)
+
+    def append(self, path: str, content: str):
+        if path in self.writes:
+            note = self.writes[path]
+            self.writes[path] = note + append_lines(note[-1:], content)
+            return
+        appended = self.appends.get(path)
+        if appended is not None:
+            content = appended + append_lines(appended[-1:], content)
+        self.appends[path] = content
+
+    def staged_content(self, path: str) -> str:
+        """The full content staged for path, None when there is none"""
+        return self.writes.get(path)
+
+    def commit(self):
+        staged = []
+        try:
+            for path, content in self.writes.items():
+                data = content.encode()
+                if _is_unchanged(path, data):
+                    self.skipped.append(path)
+                    wlogger.debug(f"{path} is unchanged, not writing it")
+                    continue
+                directory, fname = os.path.split(path)
+                tmp_path = f"{directory}/.{fname}.{os.getpid()}.tmp"
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             _file_mode(path))
+                staged.append((fd, tmp_path, path))
+                _write_all(fd, data)
+            # one fsync pass over everything before anything is renamed
+            for fd, _, _ in staged:
+                os.fsync(fd)
+        except Exception:
+            for _, tmp_path, _ in staged:
+                os.unlink(tmp_path)
+            raise
+        finally:
+            for fd, _, _ in staged:
+                os.close(fd)
+        for _, tmp_path, path in staged:
+            os.replace(tmp_path, path)
+            self.written.append(path)
+            wlogger.debug(f"Renamed {tmp_path} over {path}")
+        for path, content in self.appends.items():
+            self._append(path, content)
+            self.written.append(path)
+        for directory in {os.path.dirname(path) for path in self.written}:
+            _fsync_dir(directory)
+        self.writes, self.appends = {}, {}
+
+    def _append(self, path: str, content: str):
+        with open(path, "ab+") as f:
+            last_char = ""
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                # only a newline matters, and the last byte can be half of
+                # a multi byte character
+                last_char = f.read(1).decode("latin-1")
+            f.write(append_lines(last_char, content).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        wlogger.debug(f"Appended {len(content)} characters to {path}")
+
+
+def _fsync_dir(directory: str):
+    """Make the renames themselves durable"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,131 @@
+"""
+Fan work out over a thread or process pool, or an async pipeline
+Threads suit notes sitting on synced (Dropbox) storage where reading is the
+slow part, processes suit the CPU bound regex work on a local disk. The
+async pipeline is for storage where opening a note can block for a long
+time: many reads are in flight at once on threads driven by asyncio, and
+each note is parsed as soon as it is read, through a bounded queue, so that
+reading and parsing overlap.
+Results always come back in the order of the inputs, so whatever consumes
+them sees the same thing as a serial run. Thread workers run in a copy of
+the caller's context variables, the way asyncio.to_thread does, so that
+they see the same vault as the caller. Process workers don't: a forked one
+gets the context of the thread that forked it, a spawned one (the default
+on macOS) starts from the defaults, so only work on the default vault can go
+to the process pool
+"""
+
+import concurrent.futures
+import contextvars
+from functools import partial
+from typing import Callable, Iterable, List
+
+# looked up on first use, the process pool drags multiprocessing in
+POOLS = {
+    "thread": "ThreadPoolExecutor",
+    "process": "ProcessPoolExecutor",
+    # see pipeline_map
+    "async": None,
+}
+# reads waiting to be parsed, per read in flight
+QUEUE_PER_JOB = 2
+
+
+def parallel_map(func: Callable,
+                 *iterables: Iterable,
+                 jobs: int = 1,
+                 pool: str = "thread") -> List:
+    """map(func, *iterables) over jobs workers, func has to be a module level
+    function for the process pool"""
+    items = list(zip(*iterables))
+    if jobs <= 1 or len(items) < 2:
+        return [func(*args) for args in items]
+    if pool not in POOLS:
+        raise ValueError(f"Unknown pool {pool}, pick one of {list(POOLS)}")
+    if pool == "async":
+        # all of func counts as the read stage
+        return pipeline_map(func, _unchanged, *zip(*items), jobs=jobs)
+    executor_cls = getattr(concurrent.futures, POOLS[pool])
+    if pool == "thread":
+        func = _in_caller_context(func)
+    # hand processes bigger chunks so that pickling doesn't dominate
+    chunksize = max(1, len(items) // (jobs * 4))
+    with executor_cls(max_workers=jobs) as executor:
+        return list(executor.map(func, *zip(*items), chunksize=chunksize))
+
+
+def _unchanged(data, *args):
+    return data
+
+
+def _in_caller_context(func: Callable) -> Callable:
+    """func run in a copy of the context variables of the calling thread,
+    for the threads of the pool"""
+    return partial(_run_in_context, contextvars.copy_context(), func)
+
+
+def _run_in_context(context: contextvars.Context, func: Callable, *args):
+    # a context can only be entered by one thread at a time
+    return context.copy().run(func, *args)
+
+
+def pipeline_map(read: Callable,
+                 parse: Callable,
+                 *iterables: Iterable,
+                 jobs: int = 1,
+                 queue_size: int = None) -> List:
+    """parse(read(*args), *args) for every args of zip(*iterables). Up to
+    jobs reads run at once, on threads under an asyncio loop, and every
+    read is parsed on the calling thread as soon as it is done. At most
+    queue_size reads wait to be parsed, the readers hold back past that
+    """
+    items = list(zip(*iterables))
+    if jobs <= 1 or len(items) < 2:
+        return [parse(read(*args), *args) for args in items]
+    # asyncio is only imported for the async pool
+    import asyncio
+    return asyncio.run(
+        _pipeline(_in_caller_context(read), parse, items, jobs, queue_size
+                  or jobs * QUEUE_PER_JOB))
+
+
+async def _pipeline(read: Callable, parse: Callable, items: List[tuple],
+                    jobs: int, queue_size: int) -> List:
+    import asyncio
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    in_flight = asyncio.Semaphore(jobs)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+    async def read_one(i: int, args: tuple):
+        # a reader keeps its place until what it read is queued, so that a
+        # full queue holds back new reads
+        async with in_flight:
+            try:
+                data = await loop.run_in_executor(executor, read, *args)
+            except (Exception, SystemExit) as e:
+                # handed to the parse stage, which raises it
+                await queue.put((i, None, e))
+                return
+            await queue.put((i, data, None))
+
+    readers = asyncio.gather(*(read_one(i, args)
+                               for i, args in enumerate(items)))
+    results = [None] * len(items)
+    try:
+        for _ in items:
+            i, data, error = await queue.get()
+            if error is not None:
+                raise error
+            results[i] = parse(data, *items[i])
+        await readers
+    finally:
+        if not readers.done():
+            # a read or a parse failed, the other reads are dropped
+            readers.cancel()
+            try:
+                await readers
+            except asyncio.CancelledError:
+                pass
+        executor.shutdown(wait=False)
+    return results
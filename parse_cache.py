@@ -0,0 +1,122 @@
+"""
+Persistent cache of the todos scanned out of each note
+Old daily notes hardly ever change, so the records scanned from a note are
+kept with the mtime/size of the note and the hash of its content. A note
+whose mtime/size still match isn't read at all. One that was only touched,
+by a sync client most likely, is read but not scanned again when the hash
+of its content matches. A note that is about to be rewritten is always
+matched by the hash, a same-size edit within the mtime resolution would
+otherwise splice the moved markers at stale offsets. The cache is saved
+with marshal, which loads far quicker than JSON, and only keeps the notes
+used most recently
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from scanner import TodoRecord, note_names
+from vault_files import Stamp, load_marshal, save_marshal_atomic
+
+CACHE_VERSION = 1
+# notes kept, the least recently used ones go first
+CACHE_SIZE = 4096
+clogger = logging.getLogger(__name__)
+
+def hashing_segments(segments: Iterable[str], hasher) -> Iterator[str]:
+    """Pass the runs of lines of a note through, while hasher is fed the
+    text they join into"""
+    separator = b""
+    for segment in segments:
+        hasher.update(separator + segment.encode())
+        separator = b"\n"
+        yield segment
+
+
+class ParseCache:
+    def __init__(self,
+                 cache_file: str,
+                 notes_dir: str,
+                 max_entries: int = CACHE_SIZE):
+        self.cache_file = cache_file
+        self.notes_dir = notes_dir
+        self.max_entries = max_entries
+        # path -> (mtime_ns, size, hash, records), least recently used first
+        self.entries: OrderedDict = OrderedDict()
+        self.dirty = False
+        self.stats = {"hits": 0, "hash_hits": 0, "misses": 0, "evictions": 0}
+
+    def load(self):
+        """Load the cache from disk, a missing or unreadable cache starts
+        empty"""
+        data = load_marshal(self.cache_file,
+                            version=CACHE_VERSION,
+                            notes_dir=self.notes_dir,
+                            note_names=note_names())
+        if data is None:
+            return
+        self.entries = OrderedDict(
+            (path, (mtime_ns, size, note_hash, records))
+            for path, mtime_ns, size, note_hash, records in data["entries"])
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": CACHE_VERSION,
+            "notes_dir": self.notes_dir,
+            # the start dates in the records are links to these notes
+            "note_names": note_names(),
+            "entries": [(path, *entry)
+                        for path, entry in self.entries.items()],
+        }
+        save_marshal_atomic(self.cache_file, data)
+        self.dirty = False
+        clogger.debug(f"Saved parse cache to {self.cache_file}")
+
+    def lookup(self, path: str, stamp: Stamp) -> Optional[List[TodoRecord]]:
+        """The records of a note that wasn't touched since it was scanned"""
+        entry = self.entries.get(path)
+        if entry is None or entry[:2] != stamp:
+            return None
+        self.entries.move_to_end(path)
+        self.stats["hits"] += 1
+        return [TodoRecord._make(record) for record in entry[3]]
+
+    def lookup_content(self, path: str, stamp: Stamp,
+                       note_hash: bytes) -> Optional[List[TodoRecord]]:
+        """The records of a note whose content is still what was scanned,
+        the entry takes the new stamp"""
+        entry = self.entries.get(path)
+        if entry is None or entry[2] != note_hash:
+            return None
+        if entry[:2] != stamp:
+            self.entries[path] = (*stamp, note_hash, entry[3])
+            self.dirty = True
+        self.entries.move_to_end(path)
+        self.stats["hash_hits"] += 1
+        return [TodoRecord._make(record) for record in entry[3]]
+
+    def store(self, path: str, stamp: Stamp, note_hash: bytes,
+              records: Iterable[TodoRecord]):
+        self.stats["misses"] += 1
+        self.entries[path] = (*stamp, note_hash,
+                              tuple(tuple(record) for record in records))
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        self.dirty = True
+
+    def take_stats(self) -> Dict[str, int]:
+        """The stats since the last time they were taken"""
+        stats = self.stats
+        self.stats = dict.fromkeys(stats, 0)
+        return stats
+
+    def report(self, stats: Dict[str, int]) -> str:
+        looked_up = stats["hits"] + stats["hash_hits"] + stats["misses"]
+        return (f"Parse cache: {stats['hits']} hits, "
+                f"{stats['hash_hits']} content hits, "
+                f"{stats['misses']} misses of {looked_up} notes, "
+                f"{stats['evictions']} evicted, {len(self.entries)} cached")
@@ -0,0 +1,88 @@
+"""
+Per-phase timing and counters for a run
+Disabled by default, in which case phases and counters cost next to nothing.
+With --profile a JSON report is written per run so that runs can be
+compared over time, and optionally a cProfile dump that pstats can read
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.started_at = None
+        self.start_time = None
+        # phase -> [seconds, calls]
+        self.phases: Dict[str, list] = {}
+        self.counters = Counter()
+        self.cprofile = None
+
+    def start(self, with_cprofile: bool = False):
+        self.enabled = True
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.start_time = time.perf_counter()
+        self.phases = {}
+        self.counters = Counter()
+        if with_cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing = self.phases.setdefault(name, [0.0, 0])
+            timing[0] += time.perf_counter() - start
+            timing[1] += 1
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def report(self) -> Dict:
+        return {
+            "started_at": self.started_at,
+            "argv": sys.argv[1:],
+            "wall_seconds": round(time.perf_counter() - self.start_time, 6),
+            "phases": {
+                name: {
+                    "seconds": round(seconds, 6),
+                    "calls": calls
+                }
+                for name, (seconds, calls) in self.phases.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def stop(self, report_dir: str) -> str:
+        """Write the JSON report, and the cProfile dump if there is one, to
+        report_dir and return the report path"""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        os.makedirs(report_dir, exist_ok=True)
+        stamp = self.started_at.replace(":", "")
+        report_file = f"{report_dir}/profile-{stamp}.json"
+        with open(report_file, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{report_dir}/profile-{stamp}.pstats")
+            self.cprofile = None
+        self.enabled = False
+        return report_file
+
+
+profiler = Profiler()
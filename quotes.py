@@ -1,27 +1,50 @@
 #!/usr/local/bin/python3
 import json
-import requests
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PosixPath
 import random
 import logging
+import threading
 from typing import Dict, List, TextIO, Tuple
 
 HOME_DIR = "/Users/sahuja4/Dropbox (Facebook)/Second Brain/Scripts"
 QUOTES_FILE = "quotes.json"
 STOIC_API_GET_URL = "https://stoicquotesapi.com/v1/api/quotes"
+# 7 pages of 10 quotes each in the stoic api
+STOIC_API_PAGES = 7
+STOIC_API_TIMEOUT = 5
+# seconds a note is allowed to wait for quotes, past that the template falls
+# back to its own daily quote
+QUOTES_TIME_BUDGET = 2.0
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.INFO)
-logging.basicConfig(
-    format=
-    '%(asctime)s,%(msecs)d %(levelname)s:[%(filename)s:%(lineno)d] %(message)s',
-    datefmt='%Y-%m-%d:%H:%M:%S')
+
+
+# quotes already loaded in this process, by quotes file
+_quotes_cache: Dict[str, Dict[str, List[Tuple[str, str]]]] = {}
+# api refreshes running in the background, by quotes file
+_refreshes: Dict[str, threading.Thread] = {}
+# api refreshes that failed or ran out of time, by quotes file, the api isn't
+# waited on again for the rest of the process
+_refresh_errors: Dict[str, Exception] = {}
+_quotes_lock = threading.Lock()
 
 
 class QuotesGetter:
-    def __init__(self):
+    def __init__(self,
+                 quotes_file: str = None,
+                 api_url: str = STOIC_API_GET_URL,
+                 time_budget: float = QUOTES_TIME_BUDGET,
+                 read_only: bool = False):
         self.quotes = {}
         self.error = None
+        self.quotes_file = quotes_file or f"{HOME_DIR}/{QUOTES_FILE}"
+        self.api_url = api_url
+        self.time_budget = time_budget
+        # a dry run neither creates the quotes file nor writes api quotes to
+        # it, they are only kept for the rest of the process
+        self.read_only = read_only
 
     def get_a_random_quote(self) -> Tuple[str, str]:
         self._get_quotes()
@@ -34,23 +57,74 @@ class QuotesGetter:
         return chosen_quote
 
     def _get_quotes(self) -> Dict[str, List[Tuple[str, str]]]:
-        quotes_file = f"{HOME_DIR}/{QUOTES_FILE}"
-        quotes_file = Path(quotes_file)
-        quotes_file.touch(exist_ok=True)
+        """Quotes come from the in-process cache, then the quotes file, and
+        only then from the api. The api is called in the background and
+        waited on for at most time_budget seconds, once per process: after
+        a refresh timed out or failed, notes go without a quote right away
+        """
+        with _quotes_lock:
+            self.quotes = _quotes_cache.get(self.quotes_file)
+            if not self.quotes:
+                self.error = _refresh_errors.get(self.quotes_file)
+        if self.quotes or self.error:
+            return
+        quotes_file = Path(self.quotes_file)
+        if not self.read_only:
+            quotes_file.touch(exist_ok=True)
         self.quotes, error = get_quotes_from_file(quotes_file)
-        if error or not self.quotes or len(self.quotes) == 0:
-            quotes, error = QuotesGetterViaApi().get_quotes()
-            if error:
-                logger.error(f"Issues in getting quotes from api {error}")
-                self.error = error
-                return
-            self.quotes = quotes
-            write_out_file = open(quotes_file, "a+")
+        if not error and self.quotes:
+            with _quotes_lock:
+                _quotes_cache[self.quotes_file] = self.quotes
+            return
+        refresh = self._start_refresh()
+        refresh.join(self.time_budget)
+        if refresh.is_alive():
+            self.error = TimeoutError(
+                f"No quotes from the api within {self.time_budget}s")
+            logger.warning(f"{self.error}, the refresh carries on in the "
+                           "background")
+            with _quotes_lock:
+                # the refresh replaces it with its own outcome when it ends
+                _refresh_errors.setdefault(self.quotes_file, self.error)
+            return
+        with _quotes_lock:
+            self.quotes = _quotes_cache.get(self.quotes_file)
+            self.error = _refresh_errors.get(self.quotes_file)
+
+    def _start_refresh(self) -> threading.Thread:
+        """Start an api refresh of the quotes file, unless one is already
+        running"""
+        with _quotes_lock:
+            refresh = _refreshes.get(self.quotes_file)
+            if refresh is None or not refresh.is_alive():
+                refresh = threading.Thread(target=refresh_quotes_from_api,
+                                           args=(self.quotes_file,
+                                                 self.api_url,
+                                                 not self.read_only),
+                                           daemon=True)
+                _refreshes[self.quotes_file] = refresh
+                refresh.start()
+        return refresh
+
+
+def refresh_quotes_from_api(quotes_file: str, api_url: str,
+                            write: bool = True):
+    """Get quotes from the api and write them to quotes_file, unless write
+    is False"""
+    quotes, error = QuotesGetterViaApi(api_url).get_quotes()
+    if not error and write:
+        with open(quotes_file, "w") as write_out_file:
             error = marshal_data_and_write_to_file(quotes, write_out_file)
-            if error:
-                logger.error(f"Issues in marshalling data to file {error}")
-                self.error = error
-                return
+        if error:
+            logger.error(f"Issues in marshalling data to file {error}")
+    elif error:
+        logger.error(f"Issues in getting quotes from api {error}")
+    with _quotes_lock:
+        if error:
+            _refresh_errors[quotes_file] = error
+        else:
+            _refresh_errors.pop(quotes_file, None)
+            _quotes_cache[quotes_file] = quotes
 
 
 def get_quotes_from_file(quotes_file: PosixPath):
@@ -59,7 +133,7 @@ def get_quotes_from_file(quotes_file: PosixPath):
     error = None
     # create a file if it doesn't already exist
     try:
-        with open(quotes_file, "r+") as f:
+        with open(quotes_file, "r") as f:
             file_data = f.read()
             unmarshalled_data, error = unmarshal_data(file_data)
             logger.info(
@@ -92,25 +166,33 @@ def unmarshal_data(data: str):
 
 
 class QuotesGetterViaApi:
-    def __init__(self):
+    def __init__(self, api_url: str = STOIC_API_GET_URL):
         self.quotes = OrderedDict()
         self.error = None
+        self.api_url = api_url
 
     def get_quotes(self):
         self._get_quotes_from_stoic()
         return self.quotes, self.error
 
+    def _get_page(self, page: int):
+        # only needed when the quotes file is missing, so imported here
+        import requests
+        resp = requests.get(f"{self.api_url}?page={page}",
+                            timeout=STOIC_API_TIMEOUT)
+        if resp.status_code != 200:
+            # This means something went wrong.
+            raise IOError('GET /tasks/ {}'.format(resp.status_code))
+        return self._extract_data_from_json(resp.json())
+
     def _get_quotes_from_stoic(self):
         try:
-            # 6 is the number of pages in the stoic Api, so that gives us 60
-            # quotes
-            logging.info("Getting quotes via stoicism api")
-            for i in range(7):
-                resp = requests.get(f"{STOIC_API_GET_URL}?page={i}")
-                if resp.status_code != 200:
-                    # This means something went wrong.
-                    raise IOError('GET /tasks/ {}'.format(resp.status_code))
-                self.quotes[str(i)] = self._extract_data_from_json(resp.json())
+            logger.info("Getting quotes via stoicism api")
+            # all the pages are fetched at once
+            with ThreadPoolExecutor(max_workers=STOIC_API_PAGES) as executor:
+                pages = executor.map(self._get_page, range(STOIC_API_PAGES))
+                for i, quotes_with_author in enumerate(pages):
+                    self.quotes[str(i)] = quotes_with_author
         except Exception as e:
             self.error = e
 
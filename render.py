@@ -0,0 +1,50 @@
+"""
+Render engine shared by every note rendered in a process
+A single jinja2 Environment compiles each template once, and keeps the
+compiled bytecode on disk so that the next process can skip compiling too.
+jinja2 is only imported when the first engine is made, runs that render
+nothing never pay for it
+"""
+
+import os
+import time
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import jinja2
+
+rlogger = logging.getLogger(__name__)
+
+
+class RenderEngine:
+    def __init__(self, template_dir: str, bytecode_cache_dir: str = None):
+        from jinja2 import (Environment, FileSystemBytecodeCache,
+                            FileSystemLoader)
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        self.env = Environment(loader=FileSystemLoader(template_dir),
+                               bytecode_cache=bytecode_cache)
+        self.templates = {}
+        # exposed for the instrumentation logs
+        self.render_count = 0
+        self.render_seconds = 0.0
+
+    def get_template(self, template_name: str) -> "jinja2.Template":
+        template = self.templates.get(template_name)
+        if template is None:
+            template = self.env.get_template(template_name)
+            self.templates[template_name] = template
+        return template
+
+    def render(self, template_name: str, **context) -> str:
+        template = self.get_template(template_name)
+        start = time.perf_counter()
+        rendered = template.render(**context)
+        elapsed = time.perf_counter() - start
+        self.render_count += 1
+        self.render_seconds += elapsed
+        rlogger.debug(f"Rendered {template_name} in {elapsed * 1000:.2f}ms")
+        return rendered
@@ -0,0 +1,176 @@
+"""
+Single pass todo scanner
+OPEN_TASK_PATTERN and the start date regex are compiled once, for the names
+of the daily notes, and a whole note is matched with finditer instead of
+splitting it into lines and searching each of them. One match gives the
+indentation, marker, shame, text and the start date link of a todo.
+The patterns start with the literal "-", so the regex engine jumps straight
+between candidate positions, the leading spaces are picked up from the
+line afterwards.
+Large notes can be scanned a chunk at a time, as runs of whole lines, so
+that memory stays bounded whatever the size of the note.
+Todos are told apart by the fingerprint of their text, which leaves out
+the shame and sticky marks.
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+from typing import (Iterable, Iterator, NamedTuple, Optional, Pattern,
+                    TextIO)
+
+# shame grows by one mark a day in front of the todo text, a sticky todo
+# ends with STICKY_CHAR and never gets shamed
+SHAME_CHAR = "!"
+STICKY_CHAR = "~S~"
+# Same as OPEN_TASK_PATTERN in daily_notes, but whitespace never crosses a
+# line so that it can run over the whole note
+_OPEN_TASK = r"-[^\S\n]+\[([^\S\n]|\>)\][^\S\n]*(!*)[^\S\n]*"
+# the names of the daily notes, set with use_note_names
+_note_names = r"D\d+"
+OPEN_TASK_RE: Pattern = None
+START_DATE_RE: Pattern = None
+# characters read at a time by read_segments
+CHUNK_SIZE = 1 << 16
+
+
+class TodoRecord(NamedTuple):
+    raw_text: str
+    front_spaces: str
+    marker: str
+    shame: str
+    text: str
+    start_date_note: Optional[str]
+    # where the marker between [ ] sits in the scanned text
+    marker_offset: int
+
+
+def use_note_names(name_pattern: str):
+    """Take the start dates of todos from links to the notes whose names
+    match name_pattern, the daily notes"""
+    global _note_names, OPEN_TASK_RE, START_DATE_RE
+    _note_names = name_pattern
+    link = r"\[\[(" + name_pattern + r")\]\]"
+    # the last daily note link of the todo is its start date
+    OPEN_TASK_RE = re.compile(_OPEN_TASK + r"(?=(?:.*" + link + r")?)(.*)")
+    START_DATE_RE = re.compile(link)
+
+
+use_note_names(_note_names)
+
+
+def note_names() -> str:
+    """The pattern of daily note names the scanner was set up with"""
+    return _note_names
+
+
+def last_note_link(text: str) -> Optional[str]:
+    """The daily note the last daily note link in text points to"""
+    start_dates = START_DATE_RE.findall(text)
+    return start_dates[-1] if start_dates else None
+
+
+def _front_spaces(note_text: str, start: int) -> str:
+    """Whitespace between the start of the line and the "-" at start"""
+    line_start = note_text.rfind("\n", 0, start) + 1
+    prefix = note_text[line_start:start]
+    return prefix[len(prefix.rstrip()):]
+
+
+def scan_todos(note_text: str, base: int = 0) -> Iterator[TodoRecord]:
+    """Yield every open todo in note_text, in order, base is added to the
+    marker offsets"""
+    if "[" not in note_text:
+        return
+    for m in OPEN_TASK_RE.finditer(note_text):
+        marker, shame, start_date_note, text = m.groups()
+        start = m.start()
+        front_spaces = ""
+        if start and note_text[start - 1] != "\n":
+            front_spaces = _front_spaces(note_text, start)
+        yield TodoRecord(front_spaces + m.group(0), front_spaces, marker,
+                         shame, text, start_date_note, base + m.start(1))
+
+
+def read_segments(f: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Split what f.read().rstrip() would give into runs of whole lines,
+    reading chunk_size characters at a time. The runs joined with newlines
+    give the text back, so a line is never cut in two
+    """
+    buffer = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        # lines followed by more than whitespace can't be touched by the
+        # final rstrip, everything after them waits for the next chunk
+        cut = buffer.rfind("\n", 0, len(buffer.rstrip()))
+        if cut == -1:
+            continue
+        yield buffer[:cut]
+        buffer = buffer[cut + 1:]
+    yield buffer.rstrip()
+
+
+def scan_todo_segments(segments: Iterable[str]) -> Iterator[TodoRecord]:
+    """scan_todos over a note that comes as runs of whole lines, offsets are
+    into the whole note"""
+    base = 0
+    for segment in segments:
+        yield from scan_todos(segment, base)
+        base += len(segment) + 1
+
+
+@lru_cache(maxsize=None)
+def backlink_regex(notename: str):
+    """Open todos that link to [[notename]]"""
+    return re.compile(_OPEN_TASK + r"(.*)\[\[(" + re.escape(notename) +
+                      r")\]\]")
+
+
+def scan_backlink(line: str, notename: str) -> Optional[TodoRecord]:
+    """The todo in line that links to notename, if there is one"""
+    if "[[" not in line:
+        return None
+    m = backlink_regex(notename).search(line)
+    if not m:
+        return None
+    front_spaces = _front_spaces(line, m.start())
+    raw_text = front_spaces + m.group(0)
+    return TodoRecord(raw_text=raw_text,
+                      front_spaces=front_spaces,
+                      marker=m.group(1),
+                      shame=m.group(2),
+                      text=m.group(3),
+                      start_date_note=last_note_link(raw_text),
+                      marker_offset=m.start(1))
+
+
+def strip_start_date(text: str, start_date_note: Optional[str]) -> str:
+    """The todo text without its start date link and what follows it, the
+    text a todo is known and fingerprinted by"""
+    text = text.strip()
+    if start_date_note:
+        text = text.split(f"[[{start_date_note}]]")[0].strip()
+    return text
+
+
+def text_hash(text: str) -> str:
+    """Stable across processes, unlike hash()"""
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def normalize_todo_text(text: str) -> str:
+    """The todo text with whitespace collapsed, and without shame marks in
+    front or a sticky mark at the end"""
+    text = " ".join(text.split()).lstrip(SHAME_CHAR).lstrip()
+    if text.endswith(STICKY_CHAR):
+        text = text[:-len(STICKY_CHAR)].rstrip()
+    return text
+
+
+def todo_fingerprint(text: str) -> str:
+    """Identity of a todo, the same for todos that only differ in
+    whitespace, shame or stickiness, and stable enough to be persisted"""
+    return text_hash(normalize_todo_text(text))
@@ -0,0 +1,145 @@
+"""
+Calendar of the notes that link to a coming day
+A persisted min-heap keyed by the date of the linked daily note, with one
+entry per (linked note, source note). A note is added when it is first
+seen with the link, by the backlink index or when a run writes it, and a
+run pops the days that are due instead of looking at every note of the
+vault. Popped days stay around for a while so that a day can be generated
+again. Only where the links are is kept: the todos themselves are read from
+the source notes when their day comes, so that they are never stale
+"""
+
+import heapq
+import logging
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from backlink_index import LINK_PATTERN, walk_order
+from vault_files import load_json, save_json_atomic
+
+SCHEDULE_VERSION = 1
+# days that stay around after being popped
+SURFACED_DAYS = 31
+schlogger = logging.getLogger(__name__)
+
+
+class Schedule:
+    def __init__(self, schedule_file: str, notes_dir: str):
+        self.schedule_file = schedule_file
+        self.notes_dir = notes_dir
+        # [ordinal, target, path, notename], a heap on the ordinal
+        self.heap: List[list] = []
+        self.keys = set()
+        # target -> {"ordinal": int, "sources": [[path, notename]]} for the
+        # days already popped
+        self.surfaced = {}
+        self.popped_until = 0
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        """Load the schedule from disk, loaded stays False when there is
+        none to load and the schedule has to be built"""
+        data = load_json(self.schedule_file,
+                         version=SCHEDULE_VERSION,
+                         notes_dir=self.notes_dir)
+        if data is None:
+            return
+        self.heap = data["heap"]
+        self.keys = {(target, path) for _, target, path, _ in self.heap}
+        self.surfaced = data["surfaced"]
+        self.popped_until = data["popped_until"]
+        self.loaded = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": SCHEDULE_VERSION,
+            "notes_dir": self.notes_dir,
+            "heap": self.heap,
+            "surfaced": self.surfaced,
+            "popped_until": self.popped_until,
+        }
+        save_json_atomic(self.schedule_file, data)
+        self.dirty = False
+        schlogger.debug(f"Saved schedule to {self.schedule_file}")
+
+    def add(self, ordinal: int, target: str, path: str, notename: str):
+        if ordinal <= self.popped_until:
+            self._surface(ordinal, target, path, notename)
+            return
+        if (target, path) in self.keys:
+            return
+        heapq.heappush(self.heap, [ordinal, target, path, notename])
+        self.keys.add((target, path))
+        self.dirty = True
+
+    def add_lines(self, path: str, notename: str, lines: Iterable[str],
+                  note_ordinal: Callable[[str], Optional[int]]):
+        """Add the daily notes linked from the todo lines of a note"""
+        for line in lines:
+            for target in LINK_PATTERN.findall(line):
+                ordinal = note_ordinal(target)
+                if ordinal is not None:
+                    self.add(ordinal, target, path, notename)
+
+    def _surface(self, ordinal: int, target: str, path: str, notename: str):
+        day = self.surfaced.setdefault(target, {
+            "ordinal": ordinal,
+            "sources": []
+        })
+        if [path, notename] not in day["sources"]:
+            day["sources"].append([path, notename])
+            self.dirty = True
+
+    def pop_due(self, ordinal: int):
+        """Move every day up to ordinal out of the heap, O(log n) per entry
+        """
+        while self.heap and self.heap[0][0] <= ordinal:
+            day, target, path, notename = heapq.heappop(self.heap)
+            self.keys.discard((target, path))
+            self._surface(day, target, path, notename)
+        if ordinal > self.popped_until:
+            self.popped_until = ordinal
+            self.surfaced = {
+                target: day
+                for target, day in self.surfaced.items()
+                if day["ordinal"] > ordinal - SURFACED_DAYS
+            }
+            self.dirty = True
+
+    def covers(self, ordinal: int) -> bool:
+        """Whether the notes linking to a day are still known, a day popped
+        more than SURFACED_DAYS before the last one popped is forgotten"""
+        return ordinal > self.popped_until - SURFACED_DAYS
+
+    def sources(self, target: str) -> List[Tuple[str, str]]:
+        """(path, notename) of the notes linking to a popped day, in the
+        same order as the backlink index"""
+        sources = self.surfaced.get(target, {"sources": []})["sources"]
+        return [(path, notename) for path, notename in sorted(
+            sources, key=lambda source: walk_order(source[0], self.notes_dir))]
+
+    def upcoming(self, start: int,
+                 end: int) -> List[Tuple[int, str, str, str]]:
+        """(ordinal, target, path, notename) for the days from start up to,
+        not including, end, in date order. Only the part of the heap below
+        end is visited"""
+        found = [(day["ordinal"], target, path, notename)
+                 for target, day in self.surfaced.items()
+                 if start <= day["ordinal"] < end
+                 for path, notename in day["sources"]]
+        pending = [0] if self.heap else []
+        while pending:
+            i = pending.pop()
+            ordinal, target, path, notename = self.heap[i]
+            if ordinal >= end:
+                # nothing under it comes before end either
+                continue
+            if ordinal >= start:
+                found.append((ordinal, target, path, notename))
+            pending.extend(child for child in (2 * i + 1, 2 * i + 2)
+                           if child < len(self.heap))
+        return sorted(found,
+                      key=lambda entry:
+                      (entry[0], walk_order(entry[2], self.notes_dir)))
@@ -0,0 +1,159 @@
+"""
+Long running mode that keeps the vault hot
+The backlink index, note locations, compiled templates and quotes stay in
+memory between runs. The daily notes directory is polled for changes, so
+that only the notes that changed are re-read, and generation runs on demand
+through a local unix socket, or by itself when the day rolls over.
+A request is one line of JSON, the config for generate_daily_notes, and the
+reply is one line of JSON with ok, seconds and error
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import time
+from typing import Dict, Union
+
+import daily_notes
+
+SOCKET_NAME = ".yaps.sock"
+POLL_INTERVAL = 5.0
+REQUEST_TIMEOUT = 10.0
+MAX_REQUEST_SIZE = 64 * 1024
+slogger = logging.getLogger("daily_notes")
+
+
+def default_socket_path() -> str:
+    return f"{daily_notes.current_vault().script_dir}/{SOCKET_NAME}"
+
+
+def _read_line(conn: socket.socket) -> bytes:
+    data = b""
+    while b"\n" not in data and len(data) < MAX_REQUEST_SIZE:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data.split(b"\n", 1)[0]
+
+
+class NoteServer:
+    def __init__(self,
+                 config: Dict[str, Union[str, bool]],
+                 socket_path: str = None,
+                 poll_interval: float = POLL_INTERVAL):
+        # jobs and pool stay the server's, requests bring the rest
+        self.config = config
+        self.socket_path = socket_path or default_socket_path()
+        self.poll_interval = poll_interval
+        self.running = False
+        self.last_day = None
+
+    def run(self, config: Dict[str, Union[str, bool]]) -> float:
+        """Generate what config asks for against the hot state, and return
+        how long it took"""
+        start = time.perf_counter()
+        # pick up the notes edited since the last poll first
+        daily_notes.refresh_resident_backlink_index()
+        config = dict(config,
+                      jobs=self.config["jobs"],
+                      pool=self.config["pool"])
+        daily_notes.run_config(config)
+        return time.perf_counter() - start
+
+    def roll_over(self):
+        """Generate today's note once the day changes, the way the scheduled
+        job would, unless it is already there"""
+        today = datetime.date.today()
+        if today == self.last_day:
+            return
+        self.last_day = today
+        note_name = daily_notes.get_note_name_from_date(today)
+        dn_dir = daily_notes.current_vault().dn_dir
+        if os.path.isfile(f"{dn_dir}/{note_name}.md"):
+            slogger.info(f"{note_name} already exists, not generating it")
+            return
+        date = today.isoformat()
+        seconds = self.run(
+            dict(self.config, start_datetime=date, end_datetime=date))
+        slogger.info(f"Generated {note_name} in {seconds * 1000:.1f}ms")
+
+    def handle(self, conn: socket.socket):
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            reply = {"ok": True}
+            try:
+                config = dict(self.config)
+                config.update(json.loads(_read_line(conn)))
+                reply["seconds"] = self.run(config)
+            except Exception as e:
+                slogger.exception("Request failed")
+                reply = {"ok": False, "error": repr(e)}
+            conn.sendall(json.dumps(reply).encode() + b"\n")
+        except OSError as e:
+            slogger.warning(f"Lost client: {e}")
+        finally:
+            conn.close()
+
+    def stop(self, *_):
+        self.running = False
+
+    def serve_forever(self):
+        daily_notes.hold_backlink_index()
+        # only a day that starts while serving is generated by the server
+        self.last_day = datetime.date.today()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen()
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        signal.signal(signal.SIGTERM, self.stop)
+        slogger.info(f"Serving on {self.socket_path}")
+        self.running = True
+        try:
+            while self.running:
+                for _ in selector.select(timeout=self.poll_interval):
+                    conn, _ = listener.accept()
+                    self.handle(conn)
+                files_read = daily_notes.refresh_resident_backlink_index()
+                if files_read:
+                    slogger.info(f"Re-read {files_read} changed notes")
+                self.roll_over()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            selector.close()
+            listener.close()
+            os.unlink(self.socket_path)
+            slogger.info("Stopped serving")
+
+
+def trigger(config: Dict[str, Union[str, bool]],
+            socket_path: str = None) -> Dict:
+    """Ask a running server to generate what config asks for"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path or default_socket_path())
+        conn.sendall(json.dumps(config).encode() + b"\n")
+        return json.loads(_read_line(conn))
+
+
+def serve(args: argparse.Namespace):
+    daily_notes._configure_logger()
+    config = daily_notes.config_from_args(args)
+    NoteServer(config, args.socket, args.poll_interval
+               or POLL_INTERVAL).serve_forever()
+
+
+def trigger_from_args(args: argparse.Namespace):
+    reply = trigger(daily_notes.config_from_args(args), args.socket)
+    if not reply["ok"]:
+        raise SystemExit(reply["error"])
+    print(f"Done in {reply['seconds'] * 1000:.1f}ms")
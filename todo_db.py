@@ -0,0 +1,234 @@
+"""
+SQLite store of the todos in the daily notes
+Holds the open todos of every note, the links they carry and the history of
+what each run did with them, keyed by a stable fingerprint of the todo
+text. With it a run reads yesterday's todos and today's backlinks from the
+database instead of parsing markdown. Every note remembers the hash of the
+content it was parsed from, a reconcile picks up the notes edited by hand
+and only re-parses those whose content really changed.
+Writes made during a run go to the database in the same transaction as
+the notes, and are rolled back with them
+"""
+
+import os
+import pathlib
+import sqlite3
+import logging
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from backlink_index import LINK_PATTERN, walk_order
+from scanner import (TodoRecord, scan_todos, strip_start_date,
+                     todo_fingerprint)
+from vault_files import Stamp, content_hash, file_stamp, walk_notes
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    path TEXT PRIMARY KEY,
+    notename TEXT NOT NULL,
+    mtime_ns INTEGER,
+    size INTEGER,
+    hash BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_by_name ON notes (notename);
+CREATE TABLE IF NOT EXISTS todos (
+    path TEXT NOT NULL REFERENCES notes (path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    raw_text TEXT NOT NULL,
+    front_spaces TEXT NOT NULL,
+    marker TEXT NOT NULL,
+    shame TEXT NOT NULL,
+    text TEXT NOT NULL,
+    start_date_note TEXT,
+    marker_offset INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (path, position)
+);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    FOREIGN KEY (path, position) REFERENCES todos (path, position)
+        ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS links_by_target ON links (target);
+CREATE TABLE IF NOT EXISTS history (
+    fingerprint TEXT NOT NULL,
+    day TEXT NOT NULL,
+    src_note TEXT NOT NULL,
+    action TEXT NOT NULL,
+    shame INTEGER NOT NULL,
+    start_date_note TEXT,
+    PRIMARY KEY (fingerprint, day, src_note)
+);
+"""
+dblogger = logging.getLogger(__name__)
+
+
+def _line_at(note_text: str, offset: int) -> str:
+    start = note_text.rfind("\n", 0, offset) + 1
+    end = note_text.find("\n", offset)
+    return note_text[start:] if end == -1 else note_text[start:end]
+
+
+class TodoDatabase:
+    def __init__(self, db_file: str, notes_dir: str, read_only: bool = False):
+        """A read only database is a copy in memory of db_file, it is
+        changed like any other but never touches db_file"""
+        self.db_file = db_file
+        self.notes_dir = notes_dir
+        self.read_only = read_only
+        # transactions are started and ended explicitly
+        if read_only:
+            self.conn = sqlite3.connect(":memory:", isolation_level=None)
+            if os.path.isfile(db_file):
+                on_disk = sqlite3.connect(
+                    f"{pathlib.Path(db_file).as_uri()}?mode=ro", uri=True)
+                try:
+                    on_disk.backup(self.conn)
+                finally:
+                    on_disk.close()
+        else:
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+            self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        if self.conn.execute(
+                "PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.conn.executescript(
+                "DROP TABLE IF EXISTS links; DROP TABLE IF EXISTS todos;"
+                "DROP TABLE IF EXISTS notes; DROP TABLE IF EXISTS history;")
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.in_transaction = False
+
+    def close(self):
+        self.conn.close()
+
+    def begin(self):
+        self.conn.execute("BEGIN")
+        self.in_transaction = True
+
+    def commit(self):
+        self.conn.execute("COMMIT")
+        self.in_transaction = False
+
+    def rollback(self):
+        self.conn.execute("ROLLBACK")
+        self.in_transaction = False
+
+    def reconcile(self, read_note: Callable[[str, str], str]) -> Tuple[int,
+                                                                        int]:
+        """Match the database with the notes directory. Notes whose
+        mtime/size changed are read with read_note(notename, root), and only
+        re-parsed when their content hash changed too.
+        Returns how many notes were read and how many re-parsed
+        """
+        known = {
+            path: (mtime_ns, size, note_hash)
+            for path, mtime_ns, size, note_hash in self.conn.execute(
+                "SELECT path, mtime_ns, size, hash FROM notes")
+        }
+        files_read = parsed = 0
+        self.begin()
+        try:
+            for path, root, fname in walk_notes(self.notes_dir):
+                stamp = file_stamp(path)
+                entry = known.pop(path, None)
+                if entry is not None and entry[:2] == stamp:
+                    continue
+                notename = fname.split(".")[0]
+                note_text = read_note(notename, root)
+                files_read += 1
+                note_hash = content_hash(note_text)
+                if entry is not None and entry[2] == note_hash:
+                    # touched, by a sync client most likely, not edited
+                    self.conn.execute(
+                        "UPDATE notes SET mtime_ns = ?, size = ? "
+                        "WHERE path = ?", (*stamp, path))
+                    continue
+                self.update_note(path, notename, note_text, stamp)
+                parsed += 1
+            self.conn.executemany("DELETE FROM notes WHERE path = ?",
+                                  ((path, ) for path in known))
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        return files_read, parsed
+
+    def update_note(self,
+                    path: str,
+                    notename: str,
+                    note_text: str,
+                    stamp: Stamp = (None, None)):
+        """Replace the todos of a note with the ones in note_text. A note
+        that is only staged has no stamp, the next reconcile then compares
+        the hash of what ended up on disk"""
+        self.conn.execute("DELETE FROM notes WHERE path = ?", (path, ))
+        self.conn.execute(
+            "INSERT INTO notes (path, notename, mtime_ns, size, hash) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (path, notename, *stamp, content_hash(note_text)))
+        todos, links = [], []
+        for position, record in enumerate(scan_todos(note_text)):
+            line = _line_at(note_text, record.marker_offset)
+            text = strip_start_date(record.text, record.start_date_note)
+            todos.append((path, position, todo_fingerprint(text), *record,
+                          line))
+            if "[[" in line:
+                links.extend((path, position, target)
+                             for target in dict.fromkeys(
+                                 LINK_PATTERN.findall(line)))
+        self.conn.executemany(
+            "INSERT INTO todos (path, position, fingerprint, raw_text, "
+            "front_spaces, marker, shame, text, start_date_note, "
+            "marker_offset, line) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            todos)
+        self.conn.executemany(
+            "INSERT INTO links (path, position, target) VALUES (?, ?, ?)",
+            links)
+
+    def note_records(self, notename: str,
+                     note_hash: bytes) -> Optional[List[TodoRecord]]:
+        """The open todos of a note, in note order, None for a note that
+        isn't in the database or was stored with content other than the
+        one hashed to note_hash"""
+        row = self.conn.execute(
+            "SELECT path, hash FROM notes WHERE notename = ? "
+            "ORDER BY path LIMIT 1", (notename, )).fetchone()
+        if row is None or row[1] != note_hash:
+            return None
+        return [
+            TodoRecord(*values) for values in self.conn.execute(
+                "SELECT raw_text, front_spaces, marker, shame, text, "
+                "start_date_note, marker_offset FROM todos WHERE path = ? "
+                "ORDER BY position", row[:1])
+        ]
+
+    def backlinks(self, target: str) -> List[Tuple[str, str]]:
+        """(source notename, line) for every todo linking to target, in the
+        same order as the backlink index"""
+        rows = self.conn.execute(
+            "SELECT notes.path, position, notename, line FROM links "
+            "JOIN todos USING (path, position) JOIN notes USING (path) "
+            "WHERE target = ?", (target, )).fetchall()
+        rows.sort(key=lambda row: (walk_order(row[0], self.notes_dir), row[1]))
+        return [(notename, line) for _, _, notename, line in rows]
+
+    def record_history(self, day: str,
+                       entries: Iterable[Tuple[str, str, str, int, str]]):
+        """(fingerprint, src_note, action, shame, start_date_note) of every
+        todo carried over to day"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO history (fingerprint, day, src_note, "
+            "action, shame, start_date_note) VALUES (?, ?, ?, ?, ?, ?)",
+            ((fingerprint, day, src_note, action, shame, start_date_note)
+             for fingerprint, src_note, action, shame, start_date_note in
+             entries))
+
+    def history(self, fingerprint: str) -> List[Tuple[str, str, str, int]]:
+        """(day, src_note, action, shame) of a todo, oldest first"""
+        return self.conn.execute(
+            "SELECT day, src_note, action, shame FROM history "
+            "WHERE fingerprint = ? ORDER BY day", (fingerprint, )).fetchall()
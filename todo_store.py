@@ -0,0 +1,164 @@
+"""
+Columnar store of the todos across the daily notes
+Every open todo of every daily note is kept as a row of plain columns
+(source note date, indent, marker, shame, start date, text hash, text), with
+the rows sorted by note date and a second ordering by start date, so that
+date range queries are two bisects instead of a scan of the vault. Like the
+backlink index, every note remembers the mtime/size it was read at, and a
+refresh only re-reads the notes that changed
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from scanner import text_hash
+from vault_files import file_stamp, load_json, save_json_atomic, walk_notes
+
+STORE_VERSION = 1
+# dates are day ordinals (datetime.date.toordinal), a target of 0 is a todo
+# without a start date
+COLUMNS = ("date", "indent", "marker", "shame", "target", "text_hash", "text")
+# (indent, marker, shame, target, text) of a todo, as read from a note
+Row = Tuple[int, str, int, int, str]
+tlogger = logging.getLogger(__name__)
+
+
+class TodoStore:
+    def __init__(self, store_file: str, notes_dir: str):
+        self.store_file = store_file
+        self.notes_dir = notes_dir
+        # path -> {"stamp": (mtime_ns, size), "date": int, "rows": [Row]}
+        self.files: Dict[str, Dict] = {}
+        self.columns: Dict[str, list] = {name: [] for name in COLUMNS}
+        # rows with a start date, ordered by it
+        self.by_target: List[int] = []
+        self.targets: List[int] = []
+        self.dirty = False
+
+    def load(self):
+        """Load the store from disk, a missing or unreadable store starts
+        empty and gets rebuilt on the next refresh"""
+        data = load_json(self.store_file,
+                         version=STORE_VERSION,
+                         notes_dir=self.notes_dir)
+        if data is None:
+            return
+        self.files = data["files"]
+        for entry in self.files.values():
+            entry["stamp"] = tuple(entry["stamp"])
+        self.columns = data["columns"]
+        self.by_target = data["by_target"]
+        self.targets = [self.columns["target"][row] for row in self.by_target]
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": STORE_VERSION,
+            "notes_dir": self.notes_dir,
+            "files": self.files,
+            "columns": self.columns,
+            "by_target": self.by_target,
+        }
+        save_json_atomic(self.store_file, data)
+        self.dirty = False
+        tlogger.debug(f"Saved todo store to {self.store_file}")
+
+    def refresh(self, read_rows: Callable[[str, str], List[Row]],
+                note_date: Callable[[str], Optional[int]]) -> int:
+        """Bring the store in line with the notes directory, and return how
+        many notes were read. note_date(notename) is the day ordinal of a
+        daily note, None for any other note, which is left out.
+        read_rows(notename, root) is only called for the notes that changed
+        """
+        files = {}
+        files_read = 0
+        for path, root, fname in walk_notes(self.notes_dir):
+            notename = fname.split(".")[0]
+            date = note_date(notename)
+            if date is None:
+                continue
+            stamp = file_stamp(path)
+            entry = self.files.get(path)
+            if entry is None or entry["stamp"] != stamp:
+                entry = {
+                    "stamp": stamp,
+                    "date": date,
+                    "rows": read_rows(notename, root)
+                }
+                files_read += 1
+            files[path] = entry
+        if files_read or list(files) != list(self.files):
+            self.files = files
+            self._rebuild_columns()
+            self.dirty = True
+        return files_read
+
+    def _rebuild_columns(self):
+        columns = {name: [] for name in COLUMNS}
+        for path in sorted(self.files,
+                           key=lambda path: (self.files[path]["date"], path)):
+            date = self.files[path]["date"]
+            for indent, marker, shame, target, text in self.files[path][
+                    "rows"]:
+                columns["date"].append(date)
+                columns["indent"].append(indent)
+                columns["marker"].append(marker)
+                columns["shame"].append(shame)
+                columns["target"].append(target)
+                columns["text_hash"].append(text_hash(text))
+                columns["text"].append(text)
+        self.columns = columns
+        targets = columns["target"]
+        self.by_target = sorted(
+            (row for row, target in enumerate(targets) if target),
+            key=lambda row: targets[row])
+        self.targets = [targets[row] for row in self.by_target]
+
+    def __len__(self) -> int:
+        return len(self.columns["date"])
+
+    def select(self,
+               start: int = None,
+               end: int = None,
+               target_start: int = None,
+               target_end: int = None,
+               min_shame: int = 0,
+               max_shame: int = None,
+               marker: str = None) -> Iterator[int]:
+        """Rows with a note date in [start, end] and a start date in
+        [target_start, target_end], both ends optional, that match the rest
+        of the filters. Rows come in note date order, or in start date order
+        when a start date range is asked for"""
+        dates = self.columns["date"]
+        if target_start is not None or target_end is not None:
+            rows = self.by_target[_bisect_range(self.targets, target_start,
+                                                target_end)]
+            if start is not None or end is not None:
+                rows = [
+                    row for row in rows
+                    if (start is None or dates[row] >= start) and (
+                        end is None or dates[row] <= end)
+                ]
+        else:
+            rows = range(len(dates))[_bisect_range(dates, start, end)]
+        shames, markers = self.columns["shame"], self.columns["marker"]
+        for row in rows:
+            shame = shames[row]
+            if shame < min_shame or (max_shame is not None
+                                     and shame > max_shame):
+                continue
+            if marker is not None and markers[row] != marker:
+                continue
+            yield row
+
+    def row(self, row: int) -> Dict:
+        return {name: self.columns[name][row] for name in COLUMNS}
+
+
+def _bisect_range(values: List[int], low: int, high: int) -> slice:
+    """The slice of the sorted values that falls in [low, high]"""
+    start = 0 if low is None else bisect_left(values, low)
+    stop = len(values) if high is None else bisect_right(values, high)
+    return slice(start, stop)
@@ -0,0 +1,127 @@
+"""
+Persistent note name -> path map for the whole vault
+Built with one walk of the vault, and revalidated from directory mtimes:
+adding, removing or renaming a note changes the mtime of the directory that
+holds it, so only those directories need to be listed again
+"""
+
+import os
+import logging
+from typing import Dict, List
+
+from vault_files import load_json, save_json_atomic
+
+CACHE_VERSION = 1
+NOTE_SUFFIX = ".md"
+vlogger = logging.getLogger(__name__)
+
+
+def _dir_mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class VaultLocationCache:
+    def __init__(self, cache_file: str, vault_dir: str):
+        self.cache_file = cache_file
+        self.vault_dir = vault_dir
+        # dir -> {"mtime": mtime_ns, "notes": [notename, ...],
+        #         "subdirs": [dir, ...]}
+        self.dirs: Dict[str, Dict] = {}
+        # notename -> [path, ...]
+        self.notes: Dict[str, List[str]] = {}
+        self.dirty = False
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        data = load_json(self.cache_file,
+                         version=CACHE_VERSION,
+                         vault_dir=self.vault_dir)
+        if data is not None:
+            self.dirs = data["dirs"]
+            self._rebuild_notes()
+        else:
+            vlogger.info(f"Building note location cache for {self.vault_dir}")
+            self._scan_tree(self.vault_dir)
+            self._rebuild_notes()
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            "version": CACHE_VERSION,
+            "vault_dir": self.vault_dir,
+            "dirs": self.dirs,
+        }
+        save_json_atomic(self.cache_file, data)
+        self.dirty = False
+
+    def _scan_dir(self, path: str) -> List[str]:
+        """List a single directory, returns subdirectories not seen before"""
+        notes, subdirs = [], []
+        mtime = _dir_mtime(path)
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            self.dirs.pop(path, None)
+            self.dirty = True
+            return []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith(NOTE_SUFFIX):
+                notes.append(entry.name[:-len(NOTE_SUFFIX)])
+        self.dirs[path] = {"mtime": mtime, "notes": notes, "subdirs": subdirs}
+        self.dirty = True
+        return [subdir for subdir in subdirs if subdir not in self.dirs]
+
+    def _scan_tree(self, path: str):
+        pending = [path]
+        while pending:
+            pending.extend(self._scan_dir(pending.pop()))
+
+    def _rebuild_notes(self):
+        notes = {}
+        for path in sorted(self.dirs):
+            for notename in self.dirs[path]["notes"]:
+                notes.setdefault(notename, []).append(f"{path}/{notename}.md")
+        self.notes = notes
+
+    def revalidate(self):
+        """List again only the directories whose mtime moved, and drop the
+        ones that are gone"""
+        changed = False
+        for path in list(self.dirs):
+            entry = self.dirs.get(path)
+            if entry is None or _dir_mtime(path) == entry["mtime"]:
+                continue
+            changed = True
+            old_subdirs = entry["subdirs"]
+            for subdir in self._scan_dir(path):
+                self._scan_tree(subdir)
+            current_subdirs = self.dirs.get(path, {}).get("subdirs", [])
+            for subdir in old_subdirs:
+                if subdir not in current_subdirs:
+                    self._forget_tree(subdir)
+        if changed:
+            self._rebuild_notes()
+
+    def _forget_tree(self, path: str):
+        for subdir in self.dirs.get(path, {}).get("subdirs", []):
+            self._forget_tree(subdir)
+        self.dirs.pop(path, None)
+        self.dirty = True
+
+    def lookup(self, notename: str) -> List[str]:
+        """Paths of every note called notename inside the vault"""
+        if not self.loaded:
+            self.load()
+        paths = self.notes.get(notename, [])
+        if paths and all(os.path.isfile(path) for path in paths):
+            return paths
+        vlogger.info(f"Location of {notename} is stale, revalidating cache")
+        self.revalidate()
+        return self.notes.get(notename, [])
@@ -0,0 +1,89 @@
+"""
+Helpers shared by the persisted indexes and caches
+Walking the notes in a stable order, loading the cache files and saving
+them through a temp file that is renamed over the old one, so that a crash
+never leaves half a cache behind, the mtime/size stamp and the one hash
+of note content that every cache compares notes by
+"""
+
+import hashlib
+import json
+import marshal
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# (mtime_ns, size) of a note, the JSON caches save it as a list
+Stamp = Tuple[int, int]
+
+
+def walk_notes(notes_dir: str) -> List[Tuple[str, str, str]]:
+    """(path, root, fname) for every note under notes_dir, in a stable order
+    so that results come out the same way on every filesystem"""
+    notes = []
+    for root, d_names, f_names in os.walk(notes_dir):
+        d_names.sort()
+        for fname in sorted(f_names):
+            if fname.startswith("."):
+                # want to ignore hidden files
+                continue
+            notes.append((f"{root}/{fname}", root, fname))
+    return notes
+
+
+def file_stamp(path: str) -> Stamp:
+    """The stamp a cache entry of the file at path is checked against, a
+    missing file raises OSError"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def content_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_hash(note_text: str) -> bytes:
+    hasher = content_hasher()
+    hasher.update(note_text.encode())
+    return hasher.digest()
+
+
+def _load(path: str, mode: str, load: Callable,
+          expected: Dict[str, Any]) -> Optional[Dict]:
+    try:
+        with open(path, mode) as f:
+            data = load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or any(
+            data.get(key) != value for key, value in expected.items()):
+        return None
+    return data
+
+
+def _save_atomic(path: str, mode: str, dump: Callable, data: Dict):
+    # the cache directory is only made once there is something to keep
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, mode) as f:
+        dump(data, f)
+    os.replace(tmp_file, path)
+
+
+def load_json(path: str, **expected) -> Optional[Dict]:
+    """The object saved at path, None when it is missing, unreadable or was
+    saved with other values of the expected keys (a version, the directory
+    it describes)"""
+    return _load(path, "r", json.load, expected)
+
+
+def save_json_atomic(path: str, data: Dict):
+    _save_atomic(path, "w", json.dump, data)
+
+
+def load_marshal(path: str, **expected) -> Optional[Dict]:
+    """load_json for a file saved with marshal, which loads far quicker"""
+    return _load(path, "rb", marshal.load, expected)
+
+
+def save_marshal_atomic(path: str, data: Dict):
+    _save_atomic(path, "wb", marshal.dump, data)
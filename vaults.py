@@ -0,0 +1,110 @@
+"""
+Generate the notes of several vaults in one go
+The vaults are spread over a bounded pool of threads in this process, and
+each thread points daily_notes at its vault with configure_vault, which
+holds the paths, indexes and write transaction of the vault for that thread
+only. Most of a run is waiting on the notes, which threads overlap as well
+as processes would, without a process per worker to start. Templates and
+quotes can come from a directory shared by every vault, they are then
+compiled and loaded once for all of them.
+The vaults file is a JSON list with an object per vault, the home_dir of
+the vault and whatever config it overrides
+"""
+
+import argparse
+import json
+import logging
+import time
+from functools import partial
+from typing import Dict, List, Union
+
+import daily_notes
+from parallel import parallel_map
+from profiling import profiler
+
+WORKERS = 4
+vlogger = logging.getLogger("daily_notes")
+
+
+def load_vaults(vaults_file: str) -> List[Dict]:
+    with open(vaults_file, "r") as f:
+        vaults = json.load(f)
+    for vault in vaults:
+        if "home_dir" not in vault:
+            raise ValueError(f"A vault in {vaults_file} has no home_dir")
+    return vaults
+
+
+def run_vault(config: Dict[str, Union[str, bool]], vault: Dict,
+              shared_dir: str = None) -> Dict:
+    """Generate one vault with config, overridden by the vault's own, and
+    return how long it took and what went wrong if anything did. A failed
+    vault doesn't stop the others. A vault can't fan out to a process pool,
+    the workers wouldn't be pointed at it"""
+    config = dict(config, **{
+        key: value
+        for key, value in vault.items() if key != "home_dir"
+    })
+    start = time.perf_counter()
+    error = None
+    try:
+        if config.get("pool") == "process":
+            # a spawned worker starts out on the default vault, and forking
+            # from one of several running threads isn't safe either
+            raise ValueError("Vaults can't use the process pool, pick "
+                             "thread or async")
+        daily_notes.configure_vault(vault["home_dir"], shared_dir)
+        try:
+            daily_notes.run_config(config)
+        finally:
+            # sqlite only lets the thread that opened it close it
+            daily_notes.close_todo_db()
+    except (Exception, SystemExit) as e:
+        # get_file_content exits on a missing note
+        error = repr(e)
+        vlogger.exception(f"Failed to generate {vault['home_dir']}")
+    return {
+        "home_dir": vault["home_dir"],
+        "seconds": time.perf_counter() - start,
+        "error": error,
+    }
+
+
+def run_vaults(config: Dict[str, Union[str, bool]],
+               vaults: List[Dict],
+               workers: int = WORKERS,
+               shared_dir: str = None) -> List[Dict]:
+    """run_vault for every vault over at most workers threads, results come
+    in the order of vaults"""
+    return parallel_map(partial(run_vault, config, shared_dir=shared_dir),
+                        vaults,
+                        jobs=workers,
+                        pool="thread")
+
+
+def run_vaults_from_args(args: argparse.Namespace):
+    daily_notes._configure_logger()
+    config = daily_notes.config_from_args(args)
+    vaults = load_vaults(args.vaults_file)
+    # there is one profiler for all of the threads, it times the vaults
+    # together and reports to the local cache, next to the vaults' caches
+    profile = config["profile"]
+    config["profile"] = False
+    if profile:
+        profiler.start(with_cprofile=config["cprofile"])
+    start = time.perf_counter()
+    try:
+        results = run_vaults(config, vaults, args.workers or WORKERS,
+                             args.shared_dir)
+    finally:
+        if profile:
+            report_file = profiler.stop(f"{daily_notes.CACHE_ROOT}/profiles")
+            vlogger.info(f"Profile report written to {report_file}")
+    elapsed = time.perf_counter() - start
+    print(f"{'vault':<60} {'ms':>10}  status")
+    for result in results:
+        print(f"{result['home_dir']:<60} {result['seconds'] * 1000:>10.1f}  "
+              f"{result['error'] or 'ok'}")
+    print(f"{len(results)} vaults in {elapsed * 1000:.1f}ms")
+    if any(result["error"] for result in results):
+        raise SystemExit(1)